@@ -2,26 +2,235 @@
 """
 Fetches a chunk of Lichess PGN data from their database.
 Downloads the full file and extracts a chunk after decompression.
+
+The chunk is aligned to game boundaries: it starts at the first `[Event ` header
+at or after the offset and runs to the first `[Event ` header at or after
+offset + size, so no game is cut in half. A sidecar index with the (byte offset,
+length) of every game is written next to the chunk (see pgn_index.py).
+
+With --frame-index (or USE_FRAME_INDEX), the compressed dump is downloaded into a
+resumable local cache and a zstd seek table is built next to it, so later runs
+only decompress the frames covering the requested slice.
+
+iter_chunk_bytes() is also used by 02_process_games.py --stream, which parses the
+chunk as it is decompressed instead of reading output/games.pgn.
+
+To draw games from several months and offsets, list (dump, offset_mb, size_mb)
+specs in SLICES or in a file passed with --slices (one spec per line). Each slice
+is fetched concurrently (up to MAX_WORKERS / --workers at a time) into its own
+shard file in output/shards/.
+
+Per-stage byte counters and timings (compressed in, decompressed out, skipped,
+written) are emitted as JSON records every fetch_metrics.INTERVAL seconds and at
+the end of the run, and appended to output/fetch_metrics.jsonl.
 """
 
 import os
-import subprocess
 import sys
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, List, Optional, Tuple
+
+import requests
+import zstandard
+
+import downloader
+import fetch_metrics
+import pgn_index
+import zstd_seek
 
 # Configuration
 URL = "https://database.lichess.org/standard/lichess_db_standard_rated_2025-08.pgn.zst"
 CHUNK_SIZE_MB = 4_096  # Size of chunk to extract in MB (after decompression)
 OFFSET_MB = 15_555  # Offset from start of decompressed data in MB
 OUTPUT_FILE = "output/games.pgn"
-TEMP_FILE = "games.pgn.zst"
+CACHE_DIR = "output/cache"  # Compressed dumps, keyed by URL + ETag
+USE_FRAME_INDEX = False  # Keep the dump on disk and extract via its seek table
+READ_SIZE = 1024 * 1024
+METRICS_FILE = "output/fetch_metrics.jsonl"
 
+# Multi-slice mode: (dump, offset_mb, size_mb), where dump is a URL or a month
+# such as "2025-07". Each slice is written to SHARD_DIR/shard_NNN.pgn
+SLICES: List[Tuple[str, int, int]] = []
+SHARD_DIR = "output/shards"
+MAX_WORKERS = 4  # Slices fetched and decompressed concurrently
+DUMP_URL_TEMPLATE = (
+    "https://database.lichess.org/standard/lichess_db_standard_rated_{month}.pgn.zst"
+)
 
-def download_chunk():
-    """Download a chunk of the Lichess PGN database."""
-    # Convert MB to bytes
-    chunk_size_bytes = CHUNK_SIZE_MB * 1024 * 1024
-    offset_bytes = OFFSET_MB * 1024 * 1024
 
+def validate_output(output_path: str):
+    """Check that the extracted chunk exists and looks like PGN."""
+    # Check if file was created and has content
+    if os.path.exists(output_path):
+        file_size = os.path.getsize(output_path)
+        if file_size > 0:
+            print(f"\nSuccessfully extracted chunk to {output_path}")
+            print(f"File size: {file_size:,} bytes ({file_size / 1024 / 1024:.2f} MB)")
+
+            # Validate that we have valid PGN data
+            with open(output_path, encoding="utf-8", errors="ignore") as f:
+                first_line = f.readline().strip()
+                if first_line.startswith("["):
+                    print("✓ File appears to contain valid PGN data")
+                else:
+                    print("⚠ Warning: File may not start with valid PGN data")
+                    print(f"First line: {first_line[:50]}...")
+        else:
+            print("Error: Output file is empty")
+            sys.exit(1)
+    else:
+        print("Error: Output file was not created")
+        sys.exit(1)
+
+
+def dump_url(dump: str) -> str:
+    """Return the URL of a dump given as a URL or as a month like "2025-07"."""
+    if "://" in dump:
+        return dump
+    return DUMP_URL_TEMPLATE.format(month=dump)
+
+
+def load_slice_specs(path: str) -> List[Tuple[str, int, int]]:
+    """Read (dump, offset_mb, size_mb) specs, one whitespace-separated per line."""
+    specs = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            dump, offset_mb, size_mb = line.split()
+            specs.append((dump, int(offset_mb), int(size_mb)))
+    return specs
+
+
+def iter_indexed_dump(
+    url: str, offset_bytes: int, metrics: Optional[fetch_metrics.FetchMetrics] = None
+) -> Iterator[bytes]:
+    """Yield the cached dump from an offset, decompressing only the frames needed."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    dump_path = downloader.download(url, os.path.join(script_dir, CACHE_DIR))
+    frames = zstd_seek.load_seek_table(dump_path)
+
+    skipped = sum(1 for frame in frames if frame[2] + frame[3] <= offset_bytes)
+    print(f"Skipping {skipped}/{len(frames)} frames before the offset...")
+
+    total_size = frames[-1][2] + frames[-1][3] if frames else 0
+    yield from zstd_seek.iter_range(
+        dump_path, frames, offset_bytes, total_size - offset_bytes, metrics
+    )
+
+
+def iter_streamed_dump(
+    url: str, offset_bytes: int, metrics: Optional[fetch_metrics.FetchMetrics] = None
+) -> Iterator[bytes]:
+    """Yield the dump from an offset while streaming it over HTTP."""
+    position = 0
+
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        source = response.raw
+        if metrics:
+            source = fetch_metrics.CountingReader(source, metrics)
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            source, read_across_frames=True
+        )
+        while True:
+            started = time.perf_counter()
+            network_seconds = source.seconds if metrics else 0.0
+            data = reader.read(READ_SIZE)
+            if metrics:
+                # Time inside read() minus the time spent waiting on the network
+                network_seconds = source.seconds - network_seconds
+                elapsed = time.perf_counter() - started - network_seconds
+                metrics.add("decompressed_out", len(data), elapsed)
+            if not data:
+                break
+            chunk_start = position
+            position += len(data)
+            skipped = min(max(offset_bytes - chunk_start, 0), len(data))
+            if metrics and skipped:
+                metrics.add("skipped", skipped)
+            if position <= offset_bytes:
+                continue
+            yield data[skipped:]
+
+
+def iter_slice_bytes(
+    url: str,
+    offset_bytes: int,
+    size_bytes: int,
+    use_frame_index: bool = USE_FRAME_INDEX,
+    index: Optional[array] = None,
+    metrics: Optional[fetch_metrics.FetchMetrics] = None,
+) -> Iterator[bytes]:
+    """
+    Yield the decompressed bytes of a slice of a dump, aligned to game
+    boundaries. Game (offset, length) pairs are appended to `index` if given.
+    """
+    if use_frame_index:
+        source = iter_indexed_dump(url, offset_bytes, metrics)
+    else:
+        source = iter_streamed_dump(url, offset_bytes, metrics)
+    yield from pgn_index.iter_aligned(source, size_bytes, index)
+
+
+def iter_chunk_bytes(
+    use_frame_index: bool = USE_FRAME_INDEX, index: Optional[array] = None
+) -> Iterator[bytes]:
+    """Yield the decompressed bytes of the configured chunk (see iter_slice_bytes)."""
+    yield from iter_slice_bytes(
+        URL,
+        OFFSET_MB * 1024 * 1024,
+        CHUNK_SIZE_MB * 1024 * 1024,
+        use_frame_index,
+        index,
+    )
+
+
+def write_slice(
+    url: str,
+    offset_mb: int,
+    size_mb: int,
+    output_path: str,
+    use_frame_index: bool,
+    metrics: Optional[fetch_metrics.FetchMetrics] = None,
+    stop: Optional[threading.Event] = None,
+) -> int:
+    """
+    Write a slice and its game index to disk. Returns the number of games.
+    If `stop` is set, gives up after the current chunk without writing the index.
+    """
+    index = array("Q")
+    with open(output_path, "wb") as out:
+        for data in iter_slice_bytes(
+            url,
+            offset_mb * 1024 * 1024,
+            size_mb * 1024 * 1024,
+            use_frame_index,
+            index,
+            metrics,
+        ):
+            if stop is not None and stop.is_set():
+                return 0
+            started = time.perf_counter()
+            out.write(data)
+            if metrics:
+                metrics.add("written", len(data), time.perf_counter() - started)
+
+    if stop is not None and stop.is_set():
+        return 0
+    pgn_index.write_index(pgn_index.index_path(output_path), index)
+    return len(index) // 2
+
+
+def download_chunk(
+    use_frame_index: bool = USE_FRAME_INDEX,
+    metrics: Optional[fetch_metrics.FetchMetrics] = None,
+):
+    """Download a chunk of the Lichess PGN database."""
     print(f"Fetching {CHUNK_SIZE_MB}MB chunk from Lichess database...")
     print(f"URL: {URL}")
     print(f"Output file: {OUTPUT_FILE}")
@@ -33,76 +242,132 @@ def download_chunk():
     os.makedirs(os.path.join(script_dir, "output"), exist_ok=True)
 
     output_path = os.path.join(script_dir, OUTPUT_FILE)
+    index_path = pgn_index.index_path(output_path)
 
     try:
-        # First, check if zstd is available
-        subprocess.run(["zstd", "--version"], check=True, capture_output=True)
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        print("Error: zstd is not installed. Please install it first:")
-        print("  macOS: brew install zstd")
-        print("  Ubuntu/Debian: sudo apt-get install zstd")
-        print("  Other: https://github.com/facebook/zstd")
-        sys.exit(1)
-
-    try:
-        print("\nApproach: Streaming decompression with early termination")
-        print(f"Will extract {CHUNK_SIZE_MB}MB starting at offset {OFFSET_MB}MB\n")
-
-        # Use curl to stream the compressed file and pipe through zstdcat
-        # Then use head/tail to extract the specific chunk
-        if OFFSET_MB == 0:
-            # If no offset, just use head to get the first chunk
-            shell_cmd = f"curl -L --progress-bar '{URL}' | zstdcat | head -c {chunk_size_bytes} > '{output_path}'"
+        if use_frame_index:
+            print("\nApproach: Frame-indexed extraction from local dump")
         else:
-            # If there's an offset, we need to skip bytes first
-            # Note: This will still download and decompress from the beginning
-            shell_cmd = f"curl -L --progress-bar '{URL}' | zstdcat | tail -c +{offset_bytes + 1} | head -c {chunk_size_bytes} > '{output_path}'"
+            print("\nApproach: Streaming decompression with early termination")
+            print(
+                "Note: This will download/decompress from the beginning up to the desired chunk"
+            )
+        print(f"Will extract {CHUNK_SIZE_MB}MB starting at offset {OFFSET_MB}MB\n")
 
         print("Downloading and extracting chunk...")
-        print(
-            "Note: This will download/decompress from the beginning up to the desired chunk"
+        game_count = write_slice(
+            URL, OFFSET_MB, CHUNK_SIZE_MB, output_path, use_frame_index, metrics
         )
+        print(f"Indexed {game_count:,} games to {index_path}")
 
-        subprocess.run(shell_cmd, shell=True)
-
-        # The command might return non-zero when we terminate early, which is expected
-        # Check if file was created and has content
-        if os.path.exists(output_path):
-            file_size = os.path.getsize(output_path)
-            if file_size > 0:
-                print(f"\nSuccessfully extracted chunk to {output_path}")
-                print(
-                    f"File size: {file_size:,} bytes ({file_size / 1024 / 1024:.2f} MB)"
-                )
-
-                # Validate that we have valid PGN data
-                with open(output_path, encoding="utf-8", errors="ignore") as f:
-                    first_line = f.readline().strip()
-                    if first_line.startswith("["):
-                        print("✓ File appears to contain valid PGN data")
-                    else:
-                        print("⚠ Warning: File may not start with valid PGN data")
-                        print(f"First line: {first_line[:50]}...")
-            else:
-                print("Error: Output file is empty")
-                sys.exit(1)
-        else:
-            print("Error: Output file was not created")
-            sys.exit(1)
+        validate_output(output_path)
+
+    except KeyboardInterrupt:
+        print("\n\nDownload interrupted by user")
+        for path in (output_path, index_path):
+            if os.path.exists(path):
+                os.remove(path)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error during download: {e}")
+        sys.exit(1)
+
+
+def download_slices(
+    specs: List[Tuple[str, int, int]],
+    workers: int,
+    use_frame_index: bool,
+    metrics: Optional[fetch_metrics.FetchMetrics] = None,
+):
+    """Fetch several slices concurrently, one shard file per slice."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    shard_dir = os.path.join(script_dir, SHARD_DIR)
+    os.makedirs(shard_dir, exist_ok=True)
+
+    print(f"Fetching {len(specs)} slices with {workers} workers...")
+    print(f"Output directory: {SHARD_DIR}")
+
+    if use_frame_index:
+        # Download and index each dump once before slices start sharing it
+        for url in dict.fromkeys(dump_url(dump) for dump, _, _ in specs):
+            dump_path = downloader.download(url, os.path.join(script_dir, CACHE_DIR))
+            zstd_seek.load_seek_table(dump_path)
+
+    shards = {}
+    futures = {}
+    # Tells running slices to give up, since the pool can't interrupt them
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for i, (dump, offset_mb, size_mb) in enumerate(specs):
+            shard_path = os.path.join(shard_dir, f"shard_{i:03d}.pgn")
+            shards[shard_path] = (dump, offset_mb, size_mb)
+            future = pool.submit(
+                write_slice,
+                dump_url(dump),
+                offset_mb,
+                size_mb,
+                shard_path,
+                use_frame_index,
+                metrics,
+                stop,
+            )
+            futures[future] = shard_path
+
+        for future in as_completed(futures):
+            shard_path = futures[future]
+            dump, offset_mb, size_mb = shards[shard_path]
+            print(
+                f"✓ {os.path.basename(shard_path)}: {future.result():,} games "
+                f"({dump} @ {offset_mb}MB, {size_mb}MB)"
+            )
+        pool.shutdown()
 
     except KeyboardInterrupt:
+        stop.set()
+        # cancel_futures needs Python 3.9, so drop queued slices by hand
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=False)
         print("\n\nDownload interrupted by user")
-        if os.path.exists(output_path):
-            os.remove(output_path)
+        for shard_path in shards:
+            for path in (shard_path, pgn_index.index_path(shard_path)):
+                if os.path.exists(path):
+                    os.remove(path)
         sys.exit(1)
     except Exception as e:
+        stop.set()
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=False)
         print(f"Error during download: {e}")
         sys.exit(1)
 
+    total_size = sum(os.path.getsize(path) for path in shards)
+    print(f"\nSuccessfully extracted {len(shards)} shards to {SHARD_DIR}")
+    print(f"Total size: {total_size:,} bytes ({total_size / 1024 / 1024:.2f} MB)")
+
 
 def main():
     """Main entry point."""
-    download_chunk()
+    use_frame_index = USE_FRAME_INDEX or "--frame-index" in sys.argv
+
+    specs = SLICES
+    if "--slices" in sys.argv:
+        specs = load_slice_specs(sys.argv[sys.argv.index("--slices") + 1])
+    workers = MAX_WORKERS
+    if "--workers" in sys.argv:
+        workers = int(sys.argv[sys.argv.index("--workers") + 1])
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    os.makedirs(os.path.join(script_dir, "output"), exist_ok=True)
+    metrics_path = os.path.join(script_dir, METRICS_FILE)
+
+    with fetch_metrics.FetchMetrics(metrics_path) as metrics:
+        if specs:
+            download_slices(specs, workers, use_frame_index, metrics)
+        else:
+            download_chunk(use_frame_index, metrics)
 
 
 if __name__ == "__main__":
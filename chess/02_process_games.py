@@ -1,13 +1,82 @@
 #!/usr/bin/env python3
+import bisect
 import hashlib
+import heapq
+import importlib
+import io
+import multiprocessing
 import os
+import queue
+import re
 import sqlite3
 import sys
+import threading
+from array import array
+from collections import Counter
 from dataclasses import dataclass
 from enum import Enum
-from typing import Optional
+from itertools import repeat
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
 
 import chess.pgn
+import zstandard
+
+import game_columns
+import move_codec
+import pgn_index
+import ply_features
+import strata
+import zstd_seek
+
+# Streaming mode (--stream): parse the chunk straight from the dump while it is
+# decompressed by 01_fetch_games.py, without writing output/games.pgn
+STREAM_FROM_DUMP = False
+STREAM_BUFFER_CHUNKS = 16  # Decompressed chunks buffered ahead of the parser
+
+# Inputs can be given on the command line: a .pgn or .pgn.zst file, or a
+# directory of shards (e.g. output/shards from 01_fetch_games.py --slices)
+DEFAULT_PGN_FILE = "output/games.pgn"
+SHARD_SUFFIXES = (".pgn", ".pgn.zst")
+
+# Parallel mode (--workers N): plain .pgn inputs are split into game-aligned byte
+# ranges parsed by a process pool; this process stays the only database writer
+# and numbers games in input order, so the result is identical to a serial run
+INGEST_WORKERS = 1
+RANGE_SIZE_MB = 64  # Target size of each byte range handed to a worker
+
+# Bulk-load mode for loads into an empty database: WAL journal with relaxed
+# fsync during the load, and the games indexes built once after all rows are in
+BULK_LOAD = True
+WRITE_BATCH_SIZE = 10000  # Rows per executemany() / transaction
+
+# Quota mode (--quota N): store at most N times the step 3 target of games per
+# ELO bucket (GAME_DISTRIBUTION in strata.py), a uniform sample of the bucket's
+# games, for small test-set builds. Games that can't make the sample are
+# dropped from their headers, without parsing their movetext
+QUOTA_OVERSAMPLE: Optional[float] = None
+
+# Fill position_index with the Polyglot Zobrist key of every eligible ply, for
+# corpus-wide position dedup and frequency counts
+INDEX_POSITIONS = True
+
+# Skip games whose Site header (the Lichess game URL) matches a stored game, so
+# overlapping dumps or slices can be ingested into one database
+DEDUP_BY_SITE = True
+
+# Rewrite the memory-mappable column export (see game_columns.py) after each run
+EXPORT_COLUMNS = True
+
+HEADER_REGEX = re.compile(rb'^\[([A-Za-z0-9][A-Za-z0-9_+#=:-]*)\s+"(.*)"\]\s*$')
 
 
 class TimeControl(Enum):
@@ -37,7 +106,30 @@ class TimeControl(Enum):
 
 @dataclass
 class GameInfo:
-    """Filtered game information."""
+    """
+    Filtered game information. Slotted (and so without field defaults): one is
+    allocated per kept game, and lists of them are pickled back from workers.
+    """
+
+    __slots__ = (
+        "game_id",
+        "pgn_offset",
+        "white_elo",
+        "black_elo",
+        "avg_elo",
+        "time_control",
+        "eco",
+        "opening",
+        "result",
+        "ply_count",
+        "moves_packed",
+        "ply_features",
+        "ply_evals",
+        "pgn_frame",
+        "position_plies",
+        "position_keys",
+        "site_key",
+    )
 
     game_id: str
     pgn_offset: int
@@ -49,7 +141,13 @@ class GameInfo:
     opening: Optional[str]
     result: str
     ply_count: int
-    moves_uci: str
+    moves_packed: bytes  # move_codec.encode_moves() of the mainline
+    ply_features: bytes  # ply_features.board_features() after every ply
+    ply_evals: Optional[bytes]  # ply_features.encode_evals() of [%eval] comments
+    pgn_frame: Optional[int]
+    position_plies: array  # Eligible plies (array "I") ...
+    position_keys: array  # ... and their signed Zobrist keys (array "q")
+    site_key: Optional[int]  # site_key() of the Site header
 
 
 def parse_time_control(tc_string: str) -> Optional[tuple[int, int]]:
@@ -66,10 +164,8 @@ def parse_time_control(tc_string: str) -> Optional[tuple[int, int]]:
         return None
 
 
-def should_keep_game(game: chess.pgn.Game) -> bool:
-    """Apply game-level filters."""
-    headers = game.headers
-
+def should_keep_headers(headers: Mapping[str, str]) -> bool:
+    """Apply game-level filters. Only needs the PGN headers."""
     # Check if it's a standard rated game
     if headers.get("Variant", "Standard").lower() != "standard":
         return False
@@ -91,10 +187,78 @@ def should_keep_game(game: chess.pgn.Game) -> bool:
     return bool(headers.get("WhiteElo") and headers.get("BlackElo"))
 
 
-def extract_game_info(game: chess.pgn.Game, game_id: str, pgn_offset: int) -> GameInfo:
-    """Extract relevant game information."""
-    headers = game.headers
+# Headers used by extract_game_info(); all others are dropped while parsing
+NEEDED_HEADERS = {"WhiteElo", "BlackElo", "TimeControl", "ECO", "Opening", "Result"}
+
+
+class MainlineVisitor(chess.pgn.BaseVisitor):
+    """
+    Collects the needed headers, the mainline moves, the per-ply features and
+    [%eval] annotations (see ply_features.py) and the Zobrist keys of eligible
+    plies of a game.
+    Variations are skipped and comments/NAGs ignored, so no GameNode tree is
+    built and comments are only searched for [%eval].
+    """
 
+    def begin_game(self):
+        self.headers: Dict[str, str] = {}
+        self.moves: List[chess.Move] = []
+        self.features = bytearray()
+        self.evals = array("h")
+        self.position_plies = array("I")
+        self.position_keys = array("q")
+        self.zobrist: Optional[ply_features.ZobristTracker] = None
+
+    def visit_header(self, tagname: str, tagvalue: str):
+        if tagname in NEEDED_HEADERS:
+            self.headers[tagname] = tagvalue
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board: chess.Board, move: chess.Move):
+        if self.zobrist:
+            self.zobrist.push(board, move)
+        self.moves.append(move)
+
+    def visit_board(self, board: chess.Board):
+        if not self.moves:
+            # Start position
+            if INDEX_POSITIONS:
+                self.zobrist = ply_features.ZobristTracker(board)
+            return
+
+        # Also called after illegal moves; record exactly one entry per move
+        if len(self.features) < len(self.moves) * ply_features.FEATURE_SIZE:
+            features = ply_features.board_features(board)
+            self.features += features
+            self.evals.append(ply_features.NO_EVAL)
+            if self.zobrist and features[2] & ply_features.ELIGIBLE:
+                self.position_plies.append(len(self.moves))
+                self.position_keys.append(
+                    ply_features.signed_key(self.zobrist.key(board))
+                )
+
+    def visit_comment(self, comment: str):
+        # Lichess puts the eval of the position after a move in its comment
+        if self.moves and len(self.evals) == len(self.moves) and "[%eval" in comment:
+            value = ply_features.parse_eval(comment, len(self.moves) % 2 == 0)
+            if value is not None:
+                self.evals[-1] = value
+
+    def handle_error(self, error: Exception):
+        # Like chess.pgn.GameBuilder: log and drop the rest of the mainline
+        chess.pgn.LOGGER.error("%s while parsing game", error)
+
+    def result(self) -> "MainlineVisitor":
+        return self
+
+
+def extract_game_info(
+    mainline: MainlineVisitor, game_id: str, pgn_offset: int
+) -> GameInfo:
+    """Extract relevant game information from a MainlineVisitor result."""
+    headers = mainline.headers
     white_elo = int(headers.get("WhiteElo", 0)) or None
     black_elo = int(headers.get("BlackElo", 0)) or None
     avg_elo = (white_elo + black_elo) / 2 if white_elo and black_elo else None
@@ -104,19 +268,6 @@ def extract_game_info(game: chess.pgn.Game, game_id: str, pgn_offset: int) -> Ga
         TimeControl.from_seconds(*tc_parsed) if tc_parsed else TimeControl.CLASSICAL
     )
 
-    # Extract moves and count plies
-    moves_uci = []
-    ply_count = 0
-    board = game.board()
-    node = game
-
-    while node.variations:
-        move = node.variation(0).move
-        moves_uci.append(move.uci())
-        board.push(move)
-        ply_count += 1
-        node = node.variation(0)
-
     return GameInfo(
         game_id=game_id,
         pgn_offset=pgn_offset,
@@ -127,8 +278,44 @@ def extract_game_info(game: chess.pgn.Game, game_id: str, pgn_offset: int) -> Ga
         eco=headers.get("ECO"),
         opening=headers.get("Opening"),
         result=headers.get("Result", "*"),
-        ply_count=ply_count,
-        moves_uci=" ".join(moves_uci),
+        ply_count=len(mainline.moves),
+        moves_packed=move_codec.encode_moves(mainline.moves),
+        ply_features=bytes(mainline.features),
+        ply_evals=ply_features.encode_evals(mainline.evals),
+        pgn_frame=None,
+        position_plies=mainline.position_plies,
+        position_keys=mainline.position_keys,
+        site_key=None,
+    )
+
+
+# Columns added to games after the original schema, (name, type)
+GAMES_ADDED_COLUMNS = [
+    ("pgn_shard", "INTEGER"),
+    ("pgn_frame", "INTEGER"),
+    ("moves_packed", "BLOB"),
+    ("ply_features", "BLOB"),
+    ("ply_evals", "BLOB"),
+    ("elo_bucket", "INTEGER"),
+]
+
+
+def add_missing_columns(cursor: sqlite3.Cursor, table: str, columns: list):
+    """Add columns introduced after a database was created."""
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    for name, column_type in columns:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+
+def create_games_indexes(cursor: sqlite3.Cursor):
+    """Create the games table indexes."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_games_avg_elo ON games(avg_elo)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_games_processed ON games(processed)")
+    # Step 3 reads each ELO bucket in rand_key order straight off this index
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_games_bucket_rand_key "
+        "ON games(elo_bucket, rand_key)"
     )
 
 
@@ -150,12 +337,78 @@ def create_database(db_path: str):
             opening TEXT,
             result TEXT,
             ply_count INTEGER,
-            moves_uci TEXT,
+            moves_uci TEXT,  -- Only in unmigrated databases, see migrate_moves()
             processed BOOLEAN DEFAULT FALSE,
-            rand_key REAL
+            rand_key REAL,
+            pgn_shard INTEGER,
+            pgn_frame INTEGER,
+            moves_packed BLOB,
+            ply_features BLOB,
+            ply_evals BLOB,
+            elo_bucket INTEGER  -- Index into strata.ELO_RANGES
+        )
+    """)
+    add_missing_columns(cursor, "games", GAMES_ADDED_COLUMNS)
+
+    # Input files games were read from. A game's location is (pgn_shard,
+    # pgn_frame, pgn_offset): for .pgn.zst shards pgn_frame is the zstd frame
+    # and pgn_offset is relative to the start of that frame's decompressed data;
+    # for plain .pgn files pgn_frame is NULL and pgn_offset is a file offset
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pgn_shards (
+            shard_id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE
+        )
+    """)
+
+    # Hashed Site header (Lichess game URL) of every stored game, for dropping
+    # games already ingested from another input file
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS game_sites (
+            site_key INTEGER PRIMARY KEY,
+            game_num INTEGER
+        )
+    """)
+
+    # Game counts per ELO bucket x time control x result x ply-count bin
+    # (ply_bin is the bin's lowest ply count), updated with every batch
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS corpus_stats (
+            elo_bucket INTEGER,
+            time_control TEXT,
+            result TEXT,
+            ply_bin INTEGER,
+            games INTEGER,
+            PRIMARY KEY (elo_bucket, time_control, result, ply_bin)
+        ) WITHOUT ROWID
+    """)
+    if not cursor.execute("SELECT 1 FROM corpus_stats LIMIT 1").fetchone():
+        rebuild_corpus_stats(conn)
+
+    # Ingestion progress per input file, committed together with each batch of
+    # games: where the next unread game starts and the running counts there
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+            shard_id INTEGER PRIMARY KEY,
+            pgn_offset INTEGER,
+            game_count INTEGER,
+            filtered_count INTEGER,
+            done BOOLEAN DEFAULT FALSE
         )
     """)
 
+    # Polyglot Zobrist key of every eligible ply (see ply_features.py). game_num
+    # is the N of game_id "game_N"; keys are stored as signed 64-bit integers.
+    # Clustered on the key (no rowid, no separate index) to keep it compact
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS position_index (
+            zobrist INTEGER NOT NULL,
+            game_num INTEGER NOT NULL,
+            ply INTEGER NOT NULL,
+            PRIMARY KEY (zobrist, game_num, ply)
+        ) WITHOUT ROWID
+    """)
+
     # Positions table (for future use when we sample positions)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS positions (
@@ -174,8 +427,7 @@ def create_database(db_path: str):
     """)
 
     # Create indices
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_games_avg_elo ON games(avg_elo)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_games_processed ON games(processed)")
+    create_games_indexes(cursor)
     cursor.execute(
         "CREATE INDEX IF NOT EXISTS idx_positions_game_id ON positions(game_id)"
     )
@@ -187,85 +439,998 @@ def create_database(db_path: str):
     return conn
 
 
-def main():
-    pgn_file = "output/games.pgn"  # PGN file in output directory
-    db_file = "output/games.db"
+def begin_bulk_load(conn: sqlite3.Connection):
+    """Switch to fast load settings and drop the games indexes until the end."""
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("DROP INDEX IF EXISTS idx_games_avg_elo")
+    conn.execute("DROP INDEX IF EXISTS idx_games_processed")
+    conn.execute("DROP INDEX IF EXISTS idx_games_bucket_rand_key")
+
+
+def end_bulk_load(conn: sqlite3.Connection):
+    """Build the games indexes and restore the default durable settings."""
+    print("Building indexes...")
+    create_games_indexes(conn.cursor())
+    conn.commit()
+    conn.execute("PRAGMA synchronous = FULL")
+    # Back to a single database file for the later steps
+    conn.execute("PRAGMA journal_mode = DELETE")
+
 
-    # Check if PGN file exists
-    if not os.path.exists(pgn_file):
-        print(
-            f"Error: {pgn_file} does not exist! Run 01_fetch_games.py first.",
-            file=sys.stderr,
+def migrate_moves(conn: sqlite3.Connection, batch_size: int = WRITE_BATCH_SIZE):
+    """
+    Convert a database written before moves_packed existed: pack every game's
+    moves_uci string into moves_packed, clear moves_uci and reclaim the space.
+    """
+    cursor = conn.cursor()
+    add_missing_columns(cursor, "games", GAMES_ADDED_COLUMNS)
+    conn.commit()
+
+    migrated = 0
+    while True:
+        rows = cursor.execute(
+            """
+            SELECT rowid, moves_uci FROM games
+            WHERE moves_uci IS NOT NULL AND moves_packed IS NULL
+            LIMIT ?
+        """,
+            (batch_size,),
+        ).fetchall()
+        if not rows:
+            break
+        cursor.executemany(
+            "UPDATE games SET moves_packed = ?, moves_uci = NULL WHERE rowid = ?",
+            [(move_codec.encode_uci(moves_uci), rowid) for rowid, moves_uci in rows],
         )
-        sys.exit(1)
+        conn.commit()
+        migrated += len(rows)
+        print(f"Packed moves of {migrated} games...")
 
-    # Create database
-    conn = create_database(db_file)
+    print("Compacting database...")
+    conn.execute("VACUUM")
+    print(f"Migrated {migrated} games")
+
+
+def backfill_ply_features(conn: sqlite3.Connection, batch_size: int = WRITE_BATCH_SIZE):
+    """
+    Fill ply_features and position_index for games stored without them, by
+    replaying moves_packed through MainlineVisitor. ply_evals can't be
+    recovered this way and stays NULL.
+    """
     cursor = conn.cursor()
+    filled = 0
+    last_rowid = 0
+    while True:
+        rows = cursor.execute(
+            """
+            SELECT rowid, game_id, moves_packed FROM games
+            WHERE rowid > ? AND ply_features IS NULL AND moves_packed IS NOT NULL
+            ORDER BY rowid
+            LIMIT ?
+        """,
+            (last_rowid, batch_size),
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        positions = []
+        for rowid, game_id, moves_packed in rows:
+            mainline = MainlineVisitor()
+            mainline.begin_game()
+            board = chess.Board()
+            mainline.visit_board(board)
+            for move in move_codec.decode_moves(moves_packed):
+                mainline.visit_move(board, move)
+                board.push(move)
+                mainline.visit_board(board)
+            updates.append((bytes(mainline.features), rowid))
+            game_num = int(game_id.rpartition("_")[2])
+            positions.extend(
+                (key, game_num, ply)
+                for key, ply in zip(mainline.position_keys, mainline.position_plies)
+            )
+        cursor.executemany("UPDATE games SET ply_features = ? WHERE rowid = ?", updates)
+        cursor.executemany(
+            "INSERT OR IGNORE INTO position_index VALUES (?, ?, ?)", positions
+        )
+        conn.commit()
+        last_rowid = rows[-1][0]
+        filled += len(rows)
+        print(f"Replayed features of {filled} games...")
 
-    # Process games
-    game_count = 0
-    filtered_count = 0
+    if filled:
+        print(f"Backfilled ply_features of {filled} games")
+
+
+def assign_elo_buckets(conn: sqlite3.Connection):
+    """
+    (Re)compute every game's elo_bucket from avg_elo, for databases written
+    before the column existed or after ELO_RANGES changed.
+    """
+    conn.create_function(
+        "elo_bucket_index", 1, strata.get_elo_bucket_index, deterministic=True
+    )
+    print("Assigning ELO buckets...")
+    conn.execute("UPDATE games SET elo_bucket = elo_bucket_index(avg_elo)")
+    create_games_indexes(conn.cursor())
+    conn.commit()
+
+
+def rebuild_corpus_stats(conn: sqlite3.Connection):
+    """Recount corpus_stats from the games table."""
+    conn.create_function(
+        "elo_bucket_index", 1, strata.get_elo_bucket_index, deterministic=True
+    )
+    conn.execute("DELETE FROM corpus_stats")
+    conn.execute(
+        """
+        INSERT INTO corpus_stats
+        SELECT elo_bucket_index(avg_elo), time_control, result,
+            ply_count / ? * ?, COUNT(*)
+        FROM games
+        GROUP BY 1, 2, 3, 4
+    """,
+        (strata.PLY_BIN_SIZE, strata.PLY_BIN_SIZE),
+    )
+    conn.commit()
+
+
+def ends_in_comment(line: bytes, in_comment: bool) -> bool:
+    """
+    Return whether a movetext line ends inside a { } comment, given whether it
+    starts inside one. Comments don't nest: the first } closes a comment, and
+    a { or ; inside one is plain text. A ; comment runs to the end of the line.
+    """
+    pos = 0
+    while True:
+        if in_comment:
+            end = line.find(b"}", pos)
+            if end == -1:
+                return True
+            in_comment = False
+            pos = end + 1
+        else:
+            start = line.find(b"{", pos)
+            semicolon = line.find(b";", pos)
+            if start == -1 or -1 < semicolon < start:
+                return False
+            in_comment = True
+            pos = start + 1
+
+
+class PgnRecordReader:
+    """
+    Splits a binary PGN stream into games, parsing only the header lines.
+
+    read_headers() returns a game's headers; the caller then either parses the
+    game with read_game() or skips its movetext with skip_movetext(), which
+    only scans lines for the blank line ending the game.
+    """
+
+    def __init__(self, raw: BinaryIO, offset: int = 0):
+        self.raw = raw
+        self.offset = offset  # Position of raw within the PGN data
+        self.lines: List[bytes] = []  # Lines of the current game read so far
+        self.lookahead: Optional[bytes] = None
+
+    def _readline(self) -> bytes:
+        if self.lookahead is not None:
+            line, self.lookahead = self.lookahead, None
+            return line
+        line = self.raw.readline()
+        self.offset += len(line)
+        return line
+
+    def read_headers(self) -> Optional[Tuple[int, Dict[str, str]]]:
+        """Read the next game's headers. Returns (byte offset, headers) or None."""
+        line = self._readline()
+        while line and line.isspace():
+            line = self._readline()
+        if not line:
+            return None
+
+        pgn_offset = self.offset - len(line)
+        headers = {}
+        self.lines = []
+        while line.startswith(b"["):
+            match = HEADER_REGEX.match(line)
+            if match:
+                name = match.group(1).decode()
+                value = match.group(2).decode("utf-8", errors="replace")
+                headers[name] = value.replace('\\"', '"').replace("\\\\", "\\")
+            self.lines.append(line)
+            line = self._readline()
+
+        # First line after the headers belongs to the movetext
+        self.lookahead = line
+        return pgn_offset, headers
+
+    def _movetext_lines(self) -> Iterator[bytes]:
+        """Yield the remaining lines of the current game (movetext)."""
+        line = self._readline()
+        if line.isspace():
+            # Blank line separating headers from movetext
+            self.lines.append(line)
+            line = self._readline()
+
+        # A blank line only ends the game outside a { } comment
+        in_comment = False
+        while line and (in_comment or not line.isspace()):
+            in_comment = ends_in_comment(line, in_comment)
+            yield line
+            line = self._readline()
+
+    def skip_movetext(self):
+        """Skip the movetext of the current game without tokenizing it."""
+        for _ in self._movetext_lines():
+            pass
+
+    def read_game(self) -> Optional[MainlineVisitor]:
+        """
+        Read the movetext of the current game and parse it with MainlineVisitor.
+        Returns the visitor holding what it collected.
+        """
+        self.lines.extend(self._movetext_lines())
+        text = b"".join(self.lines).decode("utf-8", errors="replace")
+        return chess.pgn.read_game(io.StringIO(text), Visitor=MainlineVisitor)
+
+
+class QueueReader(io.RawIOBase):
+    """Readable stream over chunks put on a queue by a producer thread."""
+
+    def __init__(self, chunks: queue.Queue):
+        self.chunks = chunks
+        self.pending = b""
+        self.done = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.pending and not self.done:
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.done = True
+            elif isinstance(chunk, BaseException):
+                raise chunk
+            else:
+                self.pending = chunk
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def open_dump_stream(chunk_iter: Iterator[bytes]) -> BinaryIO:
+    """
+    Run a chunk iterator on a background thread and return a binary stream over
+    its output. The bounded queue applies backpressure to decompression when
+    parsing falls behind.
+    """
+    chunks = queue.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+
+    def produce():
+        try:
+            for chunk in chunk_iter:
+                chunks.put(chunk)
+            chunks.put(None)
+        except BaseException as e:
+            chunks.put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    return io.BufferedReader(QueueReader(chunks))
+
+
+def list_shards(path: str) -> List[str]:
+    """Return the input files for a path: the file itself or a directory's shards."""
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.endswith(SHARD_SUFFIXES)
+        )
+    return [path]
 
-    print("Processing games...")
 
-    with open(pgn_file) as pgn:
-        while True:
-            # Record offset before reading
-            pgn_offset = pgn.tell()
-            game = chess.pgn.read_game(pgn)
-            if game is None:
+def register_shard(cursor: sqlite3.Cursor, path: str) -> int:
+    """Return the shard_id of an input file, registering it if needed."""
+    cursor.execute("INSERT OR IGNORE INTO pgn_shards (path) VALUES (?)", (path,))
+    cursor.execute("SELECT shard_id FROM pgn_shards WHERE path = ?", (path,))
+    return cursor.fetchone()[0]
+
+
+def site_key(site: str) -> Optional[int]:
+    """Return a signed 64-bit hash of a Site header, or None if it is empty."""
+    if not site or site == "?":
+        return None
+    digest = hashlib.blake2b(site.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def reservoir_key(game_info: GameInfo) -> int:
+    """
+    Return a game's quota reservoir key: its site_key(), or for games without a
+    Site header a hash of their moves. Either way independent of input order.
+    """
+    if game_info.site_key is not None:
+        return game_info.site_key
+    digest = hashlib.blake2b(game_info.moves_packed, digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def open_shard(
+    path: str, offset: int = 0, frames: Optional[List[zstd_seek.Frame]] = None
+) -> BinaryIO:
+    """
+    Open a .pgn file, or a .pgn.zst file decompressed in-process, positioned at
+    `offset` of the PGN data. Seeking into a .pgn.zst file needs its seek table.
+    """
+    if path.endswith(".zst"):
+        # Closed along with the returned reader (closefd)
+        compressed = open(path, "rb")  # noqa: SIM115
+        skip = 0
+        if offset:
+            # Start decompressing at the frame holding the offset
+            frame_starts = [frame[2] for frame in frames]
+            frame = frames[bisect.bisect_right(frame_starts, offset) - 1]
+            compressed.seek(frame[0])
+            skip = offset - frame[2]
+        reader = io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(
+                compressed, read_across_frames=True, closefd=True
+            )
+        )
+        while skip > 0:
+            data = reader.read(min(skip, zstd_seek.READ_SIZE))
+            if not data:
                 break
+            skip -= len(data)
+        return reader
 
-            game_count += 1
-            if game_count % 1000 == 0:
-                print(f"Processed {game_count} games, kept {filtered_count}...")
+    f = open(path, "rb")  # noqa: SIM115
+    f.seek(offset)
+    return f
+
+
+def iter_games(
+    pgn: PgnRecordReader,
+    frame_starts: Optional[List[int]] = None,
+    end: Optional[int] = None,
+    wanted: Optional[Callable[[Mapping[str, str]], bool]] = None,
+) -> Iterator[Optional[GameInfo]]:
+    """
+    Yield a GameInfo (without game_id) for every kept game and None for every
+    filtered one, stopping at the first game starting at or after `end`.
+    Games passing the filters are also dropped if `wanted(headers)` is False.
+
+    `frame_starts` holds the decompressed start offset of each zstd frame, to
+    split offsets into (frame, offset within frame).
+    """
+    while True:
+        # Headers first: filtered games never get their movetext parsed
+        record = pgn.read_headers()
+        if record is None:
+            break
+        pgn_offset, headers = record
+        if end is not None and pgn_offset >= end:
+            break
+
+        # Apply filters
+        if not should_keep_headers(headers) or (wanted and not wanted(headers)):
+            pgn.skip_movetext()
+            yield None
+            continue
+
+        mainline = pgn.read_game()
+
+        # Locate the game inside its zstd frame
+        pgn_frame = None
+        if frame_starts:
+            pgn_frame = bisect.bisect_right(frame_starts, pgn_offset) - 1
+            pgn_offset -= frame_starts[pgn_frame]
+
+        # Extract game info (game_id is assigned by the writer)
+        game_info = extract_game_info(mainline, "", pgn_offset)
+        game_info.pgn_frame = pgn_frame
+        game_info.site_key = site_key(headers.get("Site", ""))
+        yield game_info
+
+
+class IngestQuota:
+    """
+    Per-ELO-bucket bottom-k reservoirs, for quota mode.
+
+    Each bucket keeps the kept games with the smallest reservoir_key(), a hash
+    of the Site header, so it holds a uniform sample of all the bucket's games
+    read, whatever order they come in. Any game read later could still enter a
+    reservoir, so all input is read; the reservoirs stay in memory and write()
+    stores them at the end.
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor, oversample: float):
+        self.limits = {
+            bucket: int(count * oversample)
+            for bucket, count in strata.GAME_DISTRIBUTION.items()
+        }
+
+        # Games stored by an earlier run keep their places
+        self.room = dict(self.limits)
+        cursor.execute(
+            "SELECT elo_bucket, SUM(games) FROM corpus_stats GROUP BY elo_bucket"
+        )
+        for bucket_index, games in cursor:
+            bucket = strata.ELO_BUCKET_NAMES[bucket_index]
+            self.room[bucket] = max(self.room.get(bucket, 0) - games, 0)
+
+        # Per bucket, a max-heap on the key: (-key, arrival, shard_id, GameInfo)
+        self.reservoirs: Dict[str, list] = {bucket: [] for bucket in self.room}
+        self.keys: Set[int] = set()
+
+    def _enters(self, bucket: str, key: Optional[int]) -> bool:
+        """Return whether a game with this key would enter a bucket's reservoir."""
+        room = self.room.get(bucket, 0)
+        reservoir = self.reservoirs.get(bucket)
+        if not room:
+            return False
+        if len(reservoir) < room or key is None:
+            return True
+        return key < -reservoir[0][0]
+
+    def wanted(self, headers: Mapping[str, str]) -> bool:
+        """Return whether a kept game could enter its bucket's reservoir."""
+        avg_elo = (int(headers["WhiteElo"]) + int(headers["BlackElo"])) / 2
+        return self._enters(
+            strata.get_elo_bucket(avg_elo), site_key(headers.get("Site", ""))
+        )
+
+    def holds(self, key: Optional[int]) -> bool:
+        """Return whether a game with this site_key() is in a reservoir."""
+        return key is not None and key in self.keys
 
-            # Apply filters
-            if not should_keep_game(game):
-                continue
+    def offer(self, game_info: GameInfo, arrival: int, shard_id: Optional[int]):
+        """Add a parsed game to its bucket's reservoir if its key is small enough."""
+        key = reservoir_key(game_info)
+        bucket = strata.get_elo_bucket(game_info.avg_elo)
+        if not self._enters(bucket, key):
+            return
+        reservoir = self.reservoirs[bucket]
+        entry = (-key, arrival, shard_id, game_info)
+        if len(reservoir) < self.room[bucket]:
+            heapq.heappush(reservoir, entry)
+        else:
+            self.keys.discard(-heapq.heapreplace(reservoir, entry)[0])
+        self.keys.add(key)
+
+    def write(self, writer: "GameWriter", filtered_count: int) -> int:
+        """
+        Queue the sampled games in arrival order, numbering them from
+        `filtered_count`. Returns the updated filtered_count.
+        """
+        sampled = sorted(
+            (entry for reservoir in self.reservoirs.values() for entry in reservoir),
+            key=lambda entry: entry[1],
+        )
+        for _, _, shard_id, game_info in sampled:
+            writer.add(game_info, filtered_count, shard_id)
+            filtered_count += 1
+        return filtered_count
+
+
+class GameWriter:
+    """
+    Buffers game rows and inserts them with executemany(), committing once per
+    batch instead of running one statement per game.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, batch_size: int = WRITE_BATCH_SIZE):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.batch_size = batch_size
+        self.rows: List[tuple] = []
+        # position_index rows as columns, without a tuple per row
+        self.position_keys = array("q")
+        self.position_games = array("q")
+        self.position_plies = array("I")
+        self.checkpoints: Dict[int, tuple] = {}  # Pending, by shard_id
+        self.site_rows: List[Tuple[int, int]] = []
+        self.pending_sites: Set[int] = set()
+        self.duplicates = 0
+        # Pending corpus_stats increments
+        self.stats: Counter = Counter()
+
+    def add(self, game_info: GameInfo, filtered_count: int, shard_id: Optional[int]):
+        """Number a kept game and queue it for insertion."""
+        game_id = f"game_{filtered_count:06d}"
+        game_info.game_id = game_id
+
+        # Generate deterministic random key based on game_id
+        rand_key = int(
+            hashlib.sha256(f"rand_{game_id}".encode()).hexdigest()[:16], 16
+        ) / float(2**64)
+
+        elo_bucket = strata.get_elo_bucket_index(game_info.avg_elo)
+        self.stats[
+            (
+                elo_bucket,
+                game_info.time_control.value,
+                game_info.result,
+                game_info.ply_count // strata.PLY_BIN_SIZE * strata.PLY_BIN_SIZE,
+            )
+        ] += 1
+
+        self.rows.append(
+            (
+                game_info.game_id,
+                game_info.pgn_offset,
+                game_info.white_elo,
+                game_info.black_elo,
+                game_info.avg_elo,
+                game_info.time_control.value,
+                game_info.eco,
+                game_info.opening,
+                game_info.result,
+                game_info.ply_count,
+                game_info.moves_packed,
+                game_info.ply_features,
+                game_info.ply_evals,
+                rand_key,
+                shard_id,
+                game_info.pgn_frame,
+                elo_bucket,
+            )
+        )
+        self.position_keys.extend(game_info.position_keys)
+        self.position_games.extend(repeat(filtered_count, len(game_info.position_keys)))
+        self.position_plies.extend(game_info.position_plies)
+        if game_info.site_key is not None:
+            self.site_rows.append((game_info.site_key, filtered_count))
+            self.pending_sites.add(game_info.site_key)
 
-            # Extract game info
-            game_id = f"game_{filtered_count:06d}"
-            game_info = extract_game_info(game, game_id, pgn_offset)
+    def is_duplicate(self, key: Optional[int]) -> bool:
+        """
+        Return whether a game with this site_key() is already stored or queued,
+        counting it in `duplicates` if so.
+        """
+        if key is None:
+            return False
+        duplicate = (
+            key in self.pending_sites
+            or self.cursor.execute(
+                "SELECT 1 FROM game_sites WHERE site_key = ?", (key,)
+            ).fetchone()
+            is not None
+        )
+        self.duplicates += duplicate
+        return duplicate
 
-            # Generate deterministic random key based on game_id
-            rand_key = int(
-                hashlib.sha256(f"rand_{game_id}".encode()).hexdigest()[:16], 16
-            ) / float(2**64)
+    def checkpoint(
+        self,
+        shard_id: Optional[int],
+        pgn_offset: int,
+        game_count: int,
+        filtered_count: int,
+        done: bool = False,
+    ):
+        """
+        Record that everything before `pgn_offset` of a shard has been queued,
+        and flush once a batch is full. A checkpoint is only ever committed in
+        the same transaction as the games before it.
+        """
+        if shard_id is not None:
+            self.checkpoints[shard_id] = (
+                shard_id,
+                pgn_offset,
+                game_count,
+                filtered_count,
+                done,
+            )
+        if len(self.rows) >= self.batch_size:
+            self.flush()
 
-            # Store in database
-            cursor.execute(
+    def flush(self):
+        """Insert all queued rows, save the checkpoints and commit."""
+        if self.rows:
+            self.cursor.executemany(
                 """
                 INSERT INTO games (
-                    game_id, pgn_offset, white_elo, black_elo, avg_elo, time_control,
-                    eco, opening, result, ply_count, moves_uci, rand_key
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    game_id, pgn_offset, white_elo, black_elo, avg_elo,
+                    time_control, eco, opening, result, ply_count,
+                    moves_packed, ply_features, ply_evals, rand_key, pgn_shard,
+                    pgn_frame, elo_bucket
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                self.rows,
+            )
+            self.rows = []
+        if self.position_keys:
+            self.cursor.executemany(
+                "INSERT INTO position_index VALUES (?, ?, ?)",
+                zip(self.position_keys, self.position_games, self.position_plies),
+            )
+            self.position_keys = array("q")
+            self.position_games = array("q")
+            self.position_plies = array("I")
+        if self.site_rows:
+            self.cursor.executemany(
+                "INSERT OR IGNORE INTO game_sites VALUES (?, ?)", self.site_rows
+            )
+            self.site_rows = []
+            self.pending_sites = set()
+        if self.stats:
+            self.cursor.executemany(
+                """
+                INSERT INTO corpus_stats VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (elo_bucket, time_control, result, ply_bin)
+                DO UPDATE SET games = games + excluded.games
             """,
-                (
-                    game_info.game_id,
-                    game_info.pgn_offset,
-                    game_info.white_elo,
-                    game_info.black_elo,
-                    game_info.avg_elo,
-                    game_info.time_control.value,
-                    game_info.eco,
-                    game_info.opening,
-                    game_info.result,
-                    game_info.ply_count,
-                    game_info.moves_uci,
-                    rand_key,
-                ),
+                [(*key, games) for key, games in self.stats.items()],
             )
+            self.stats = Counter()
+        if self.checkpoints:
+            self.cursor.executemany(
+                "INSERT OR REPLACE INTO ingest_checkpoints VALUES (?, ?, ?, ?, ?)",
+                list(self.checkpoints.values()),
+            )
+            self.checkpoints = {}
+        self.conn.commit()
+
+
+def load_checkpoints(cursor: sqlite3.Cursor) -> Dict[int, Tuple[int, int, int, bool]]:
+    """Return the saved (pgn_offset, game_count, filtered_count, done) by shard."""
+    cursor.execute(
+        """
+        SELECT shard_id, pgn_offset, game_count, filtered_count, done
+        FROM ingest_checkpoints
+    """
+    )
+    return {row[0]: (row[1], row[2], row[3], bool(row[4])) for row in cursor}
+
+
+def resume_counts(
+    cursor: sqlite3.Cursor,
+    checkpoints: Dict[int, Tuple[int, int, int, bool]],
+) -> Tuple[int, int]:
+    """
+    Return the (game_count, filtered_count) an interrupted run stopped at, or
+    that new games continue from. Games stored without checkpoints (--stream
+    runs, databases from before checkpoints) still take up their game numbers.
+    """
+    game_count, filtered_count = 0, 0
+    if checkpoints:
+        _, game_count, filtered_count, _ = max(
+            checkpoints.values(), key=lambda checkpoint: checkpoint[1:3]
+        )
+
+    # Game numbers only grow, so the last inserted game has the highest one
+    cursor.execute("SELECT game_id FROM games ORDER BY rowid DESC LIMIT 1")
+    row = cursor.fetchone()
+    if row is not None:
+        filtered_count = max(filtered_count, int(row[0].rsplit("_", 1)[1]) + 1)
+    return max(game_count, filtered_count), filtered_count
+
+
+def ingest_games(
+    pgn: PgnRecordReader,
+    writer: GameWriter,
+    shard_id: Optional[int] = None,
+    frames: Optional[List[zstd_seek.Frame]] = None,
+    game_count: int = 0,
+    filtered_count: int = 0,
+    quota: Optional[IngestQuota] = None,
+) -> tuple[int, int]:
+    """
+    Parse, filter and store games. Numbering continues from the given counts.
+    With a quota, kept games are offered to its reservoirs instead, to be
+    stored by IngestQuota.write().
+    Returns the updated (game_count, filtered_count).
+    """
+    frame_starts = [frame[2] for frame in frames] if frames else None
 
+    def wanted(headers: Mapping[str, str]) -> bool:
+        key = site_key(headers.get("Site", ""))
+        if DEDUP_BY_SITE and writer.is_duplicate(key):
+            return False
+        if quota is None:
+            return True
+        if DEDUP_BY_SITE and quota.holds(key):
+            writer.duplicates += 1
+            return False
+        return quota.wanted(headers)
+
+    for game_info in iter_games(pgn, frame_starts, wanted=wanted):
+        game_count += 1
+        if game_count % 1000 == 0:
+            print(f"Processed {game_count} games, kept {filtered_count}...")
+
+        if game_info is not None and quota:
+            quota.offer(game_info, game_count, shard_id)
+        elif game_info is not None:
+            writer.add(game_info, filtered_count, shard_id)
             filtered_count += 1
 
-    conn.commit()
+        writer.checkpoint(shard_id, pgn.offset, game_count, filtered_count)
+
+    return game_count, filtered_count
+
+
+def next_game_start(raw: BinaryIO, offset: int) -> Optional[int]:
+    """
+    Return where the first game after `offset` starts, reading from a stream
+    positioned at `offset`, or None if no game starts after it.
+    """
+    window = raw.read(1024 * 1024)
+    while window:
+        found = window.find(pgn_index.BOUNDARY)
+        if found != -1:
+            return offset + found + 1
+        # Keep a tail in case the marker straddles two reads
+        tail = window[-len(pgn_index.BOUNDARY) :]
+        offset += len(window) - len(tail)
+        more = raw.read(1024 * 1024)
+        window = tail + more if more else b""
+    return None
+
+
+def split_ranges(
+    path: str, range_size: int, frames: Optional[List[zstd_seek.Frame]] = None
+) -> List[Tuple[int, int]]:
+    """
+    Split a PGN file into byte ranges of about `range_size` that start on game
+    boundaries, using the game index from 01_fetch_games.py when available.
+
+    A .pgn.zst file (with its seek table in `frames`) can only be entered at a
+    frame start, so its ranges start at the first game of a frame, with frames
+    grouped to about `range_size` of decompressed data.
+    """
+    starts = [0]
+    idx_path = pgn_index.index_path(path)
+
+    # Offsets to look for the next game start from
+    guesses: List[int] = []
+    if frames is not None:
+        size = frames[-1][2] + frames[-1][3] if frames else 0
+        for _, _, frame_start, _ in frames:
+            if frame_start - (guesses[-1] if guesses else 0) >= range_size:
+                guesses.append(frame_start)
+    elif os.path.exists(idx_path):
+        size = os.path.getsize(path)
+        for offset, _ in pgn_index.iter_index(pgn_index.read_index(idx_path)):
+            if offset - starts[-1] >= range_size:
+                starts.append(offset)
+    else:
+        size = os.path.getsize(path)
+        guesses = list(range(range_size, size, range_size))
+
+    for guess in guesses:
+        if guess <= starts[-1]:
+            continue
+        with open_shard(path, guess, frames) as raw:
+            start = next_game_start(raw, guess)
+        if start is not None:
+            starts.append(start)
+
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def parse_range(task: tuple) -> Tuple[int, List[GameInfo]]:
+    """
+    Worker: parse the games starting in one byte range of a file (of the
+    decompressed data for .pgn.zst). Returns (games seen, kept games).
+    """
+    path, start, end, frames = task
+    frame_starts = [frame[2] for frame in frames] if frames else None
+    game_count = 0
+    kept = []
+
+    with open_shard(path, start, frames) as raw:
+        pgn = PgnRecordReader(raw, start)
+        for game_info in iter_games(pgn, frame_starts, end):
+            game_count += 1
+            if game_info is not None:
+                kept.append(game_info)
+
+    return game_count, kept
+
+
+def ingest_parallel(
+    shard_paths: List[str],
+    writer: GameWriter,
+    workers: int,
+    checkpoints: Dict[int, Tuple[int, int, int, bool]],
+    game_count: int = 0,
+    filtered_count: int = 0,
+) -> tuple[int, int]:
+    """
+    Parse inputs in a process pool and store the results from this process, in
+    input order, skipping what `checkpoints` says is already stored.
+    Returns the updated (game_count, filtered_count).
+    """
+    range_size = RANGE_SIZE_MB * 1024 * 1024
+    tasks = []
+    task_shards = []  # (shard_id, last range of the shard)
+
+    for shard_path in shard_paths:
+        shard_id = register_shard(writer.cursor, shard_path)
+        offset, _, _, done = checkpoints.get(shard_id, (0, 0, 0, False))
+        if done:
+            continue
+
+        frames = None
+        if shard_path.endswith(".zst"):
+            frames = zstd_seek.load_seek_table(shard_path)
+        ranges = split_ranges(shard_path, range_size, frames)
+
+        # Checkpoints are game boundaries, so ranges can start there
+        ranges = [(max(start, offset), end) for start, end in ranges if end > offset]
+        for i, (start, end) in enumerate(ranges):
+            tasks.append((shard_path, start, end, frames))
+            task_shards.append((shard_id, i == len(ranges) - 1))
+
+    print(f"Parsing {len(tasks)} ranges with {workers} workers...")
+
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.imap(parse_range, tasks)
+        for task, (shard_id, last), (seen, kept) in zip(tasks, task_shards, results):
+            for game_info in kept:
+                if DEDUP_BY_SITE and writer.is_duplicate(game_info.site_key):
+                    continue
+                writer.add(game_info, filtered_count, shard_id)
+                filtered_count += 1
+            game_count += seen
+            writer.checkpoint(shard_id, task[2], game_count, filtered_count, last)
+            print(f"Processed {game_count} games, kept {filtered_count}...")
+
+    return game_count, filtered_count
+
+
+def main():
+    db_file = "output/games.db"
+
+    if "--export-columns" in sys.argv:
+        # (Re)write the columnar export of an existing database and exit
+        conn = sqlite3.connect(db_file)
+        games = game_columns.export_columns(conn)
+        conn.close()
+        print(f"Exported {games} games to {game_columns.COLUMNS_DIR}")
+        return
+
+    if "--migrate" in sys.argv:
+        # Bring an existing database up to the current schema and exit
+        conn = create_database(db_file)
+        migrate_moves(conn)
+        backfill_ply_features(conn)
+        assign_elo_buckets(conn)
+        rebuild_corpus_stats(conn)
+        conn.close()
+        return
+
+    stream = STREAM_FROM_DUMP or "--stream" in sys.argv
+    workers = INGEST_WORKERS
+    if "--workers" in sys.argv:
+        workers = int(sys.argv[sys.argv.index("--workers") + 1])
+    oversample = QUOTA_OVERSAMPLE
+    if "--quota" in sys.argv:
+        oversample = float(sys.argv[sys.argv.index("--quota") + 1])
+    inputs = [
+        arg
+        for i, arg in enumerate(sys.argv[1:], 1)
+        if not arg.startswith("--") and sys.argv[i - 1] not in ("--workers", "--quota")
+    ]
+    inputs = inputs or [DEFAULT_PGN_FILE]
+
+    # Check if the PGN inputs exist
+    for pgn_path in [] if stream else inputs:
+        if not os.path.exists(pgn_path):
+            print(
+                f"Error: {pgn_path} does not exist! Run 01_fetch_games.py first.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+    shard_paths = [shard for path in inputs for shard in list_shards(path)]
+
+    # Create database
+    conn = create_database(db_file)
+    writer = GameWriter(conn)
+
+    # Rebuilding the indexes over games already stored would cost more than
+    # keeping them up to date, so only a load into an empty table defers them
+    bulk_load = (
+        BULK_LOAD
+        and not writer.cursor.execute("SELECT 1 FROM games LIMIT 1").fetchone()
+    )
+
+    # Continue where an interrupted run stopped, with the same numbering
+    checkpoints = load_checkpoints(writer.cursor)
+    game_count, filtered_count = resume_counts(writer.cursor, checkpoints)
+
+    quota = None
+    if oversample:
+        quota = IngestQuota(writer.cursor, oversample)
+        print(f"Quota mode: storing up to {quota.limits} games per ELO bucket")
+        if workers > 1:
+            # Dropping games from their headers happens in the parser
+            print("Quota mode parses serially, ignoring --workers")
+            workers = 1
+
+    print("Processing games...")
+    if game_count:
+        print(f"Resuming after {game_count} games ({filtered_count} kept)")
+
+    if bulk_load:
+        begin_bulk_load(conn)
+    try:
+        if stream:
+            # Module name starts with a digit, so it can't be a plain import
+            fetch_games = importlib.import_module("01_fetch_games")
+            use_frame_index = fetch_games.USE_FRAME_INDEX or "--frame-index" in sys.argv
+            print(
+                f"Streaming {fetch_games.CHUNK_SIZE_MB}MB chunk from {fetch_games.URL}"
+            )
+            with open_dump_stream(fetch_games.iter_chunk_bytes(use_frame_index)) as raw:
+                game_count, filtered_count = ingest_games(
+                    PgnRecordReader(raw), writer, quota=quota
+                )
+        elif workers > 1:
+            game_count, filtered_count = ingest_parallel(
+                shard_paths,
+                writer,
+                workers,
+                checkpoints,
+                game_count,
+                filtered_count,
+            )
+        else:
+            for shard_path in shard_paths:
+                shard_id = register_shard(writer.cursor, shard_path)
+                offset, _, _, done = checkpoints.get(shard_id, (0, 0, 0, False))
+                if done:
+                    print(f"Skipping {shard_path} (already ingested)")
+                    continue
+
+                print(f"Reading {shard_path}...")
+                if offset:
+                    print(f"  resuming at byte {offset:,}")
+                frames = None
+                if shard_path.endswith(".zst"):
+                    frames = zstd_seek.load_seek_table(shard_path)
+                with open_shard(shard_path, offset, frames) as raw:
+                    pgn = PgnRecordReader(raw, offset)
+                    game_count, filtered_count = ingest_games(
+                        pgn,
+                        writer,
+                        shard_id,
+                        frames,
+                        game_count,
+                        filtered_count,
+                        quota,
+                    )
+                writer.checkpoint(
+                    shard_id, pgn.offset, game_count, filtered_count, done=True
+                )
+
+        if quota:
+            # Committed in one transaction with the checkpoints, so an
+            # interrupted quota run starts over
+            filtered_count = quota.write(writer, filtered_count)
+        writer.flush()
+    finally:
+        if bulk_load:
+            # Drop any partial batch (its checkpoint wasn't saved either), then
+            # build the indexes even if ingestion failed
+            conn.rollback()
+            end_bulk_load(conn)
+
+    if EXPORT_COLUMNS:
+        print(f"Exporting game columns to {game_columns.COLUMNS_DIR}...")
+        game_columns.export_columns(conn)
     conn.close()
 
     print("\nProcessing complete!")
     print(f"Total games processed: {game_count}")
     print(f"Games kept after filtering: {filtered_count}")
+    if writer.duplicates:
+        print(f"Duplicate games skipped (same Site): {writer.duplicates}")
     print(f"Database saved to: {db_file}")
 
 
@@ -1,17 +1,24 @@
 #!/usr/bin/env python3
+import asyncio
 import csv
 import hashlib
 import os
 import random
 import sqlite3
 import sys
+from array import array
 from collections import defaultdict
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
 import chess
 import chess.engine
 import chess.pgn
+import chess.polyglot
+
+import move_codec
+import ply_features
+from strata import ELO_BUCKET_NAMES, GAME_DISTRIBUTION, get_elo_bucket
 
 # Configuration
 STOCKFISH_PATH = "stockfish"  # Assumes stockfish is in PATH
@@ -20,18 +27,27 @@ MULTI_PV = 4
 SALT = "chess_position_salt_v1"
 OUTPUT_CSV = "output/positions.csv"
 
-# ELO buckets: [0, 1400), [1400, 1800), [1800, 2200), [2200, 2600), [2600, inf)
-ELO_RANGES = [(0, 1400), (1400, 1800), (1800, 2200), (2200, 2600), (2600, 9999)]
-ELO_BUCKET_NAMES = ["0-1400", "1400-1800", "1800-2200", "2200-2600", "2600+"]
+# Skip positions reached in more than this many games of the corpus (common
+# opening lines and transpositions), counted in the position index filled by
+# 02_process_games.py. None disables the check
+MAX_POSITION_GAMES = None
+
+# Pre-screen mode (--eval-prescreen): guess tactical vs quiet from the swing of
+# the Lichess [%eval] annotations around the sampled ply, and skip the engine
+# call when the guessed stratum is already full. Labels still come from
+# Stockfish; games without evals are always analyzed
+EVAL_PRESCREEN = False
+PRESCREEN_TACTICAL_SWING = 150  # Eval swing (cp) that suggests a tactical position
+PRESCREEN_QUIET_SWING = 30  # Eval swing (cp) that suggests a quiet position
+
+# Stockfish processes classifying positions concurrently (--engines N), and
+# positions queued ahead per engine. Results are applied in game order, so the
+# output is the same for any number of engines
+ENGINE_WORKERS = 1
+ENGINE_LOOKAHEAD = 2
 
-# Target distribution for 800 games positions
-GAME_DISTRIBUTION = {
-    "0-1400": 20,
-    "1400-1800": 50,
-    "1800-2200": 70,
-    "2200-2600": 40,
-    "2600+": 20,
-}
+# Games fetched per query when scanning an ELO bucket in rand_key order
+GAME_PAGE_SIZE = 1000
 
 # Phase ratios within each ELO bucket
 PHASE_RATIOS = {"opening": 0.2, "middlegame": 0.6, "endgame": 0.2}
@@ -58,40 +74,38 @@ class Position:
     hash_bucket: int
 
 
-def get_elo_bucket(avg_elo: float) -> str:
-    """Return the ELO bucket name for a given average ELO."""
-    for i, (min_elo, max_elo) in enumerate(ELO_RANGES):
-        if min_elo <= avg_elo < max_elo:
-            return ELO_BUCKET_NAMES[i]
-    return ELO_BUCKET_NAMES[-1]
-
-
-def get_material_count(board: chess.Board) -> int:
-    """Count non-king material on the board."""
-    material = 0
-    piece_values = {
-        chess.PAWN: 1,
-        chess.KNIGHT: 3,
-        chess.BISHOP: 3,
-        chess.ROOK: 5,
-        chess.QUEEN: 9,
-    }
-
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
-        if piece and piece.piece_type != chess.KING:
-            material += piece_values.get(piece.piece_type, 0)
-
-    return material
+def iter_bucket_games(
+    conn: sqlite3.Connection, bucket_index: int, page_size: int = GAME_PAGE_SIZE
+) -> Iterator[Tuple[str, bytes, bytes, Optional[bytes], float]]:
+    """
+    Yield (game_id, moves_packed, ply_features, ply_evals, avg_elo) for the
+    games of an ELO bucket in rand_key order. Pages are read with keyset
+    pagination on (rand_key, rowid) along idx_games_bucket_rand_key, so the
+    bucket is never sorted and only one page is held in memory.
+    """
+    last_key = (-1.0, -1)
+    while True:
+        rows = conn.execute(
+            """
+            SELECT rand_key, rowid, game_id, moves_packed, ply_features, ply_evals,
+                avg_elo
+            FROM games
+            WHERE elo_bucket = ? AND (rand_key, rowid) > (?, ?)
+                AND moves_packed IS NOT NULL
+            ORDER BY rand_key, rowid
+            LIMIT ?
+        """,
+            (bucket_index, *last_key, page_size),
+        ).fetchall()
+        for row in rows:
+            yield row[2:]
+        if len(rows) < page_size:
+            return
+        last_key = rows[-1][:2]
 
 
-def get_phase(board: chess.Board, ply: int) -> str:
-    """Determine game phase based on position and ply count."""
-    material = get_material_count(board)
-    has_queens = bool(
-        board.pieces(chess.QUEEN, chess.WHITE) or board.pieces(chess.QUEEN, chess.BLACK)
-    )
-
+def get_phase_from_features(ply: int, material: int, has_queens: bool) -> str:
+    """Determine game phase from ply count, material and queen presence."""
     # Opening: ply ≤ 20 & queens present & material ≥ 26
     if ply <= 20 and has_queens and material >= 26:
         return "opening"
@@ -143,6 +157,37 @@ def calculate_pos_id(fen4: str) -> Tuple[str, int]:
     return pos_id, hash_bucket
 
 
+def count_position_games(conn: sqlite3.Connection, board: chess.Board) -> int:
+    """Return how many corpus games reach a position, from position_index."""
+    key = ply_features.signed_key(chess.polyglot.zobrist_hash(board))
+    cursor = conn.execute(
+        "SELECT COUNT(DISTINCT game_num) FROM position_index WHERE zobrist = ?",
+        (key,),
+    )
+    return cursor.fetchone()[0]
+
+
+def prescreen_type(evals: array, ply: int) -> Optional[str]:
+    """
+    Guess "tactical" or "quiet" for the position after `ply` from the largest
+    eval change between plies ply - 1, ply and ply + 1. Returns None when evals
+    are missing or the swing is in between the thresholds.
+    """
+    around = evals[max(ply - 2, 0) : ply + 1]
+    if len(around) < 2 or ply_features.NO_EVAL in around:
+        return None
+
+    if abs(evals[ply - 1]) >= ply_features.MATE_SCORE - 1000:
+        return "tactical"
+
+    swing = max(abs(b - a) for a, b in zip(around, around[1:]))
+    if swing >= PRESCREEN_TACTICAL_SWING:
+        return "tactical"
+    if swing <= PRESCREEN_QUIET_SWING:
+        return "quiet"
+    return None
+
+
 def is_capture_or_check(board: chess.Board, move: chess.Move) -> bool:
     """Check if a move is a capture or gives check."""
     if board.is_capture(move):
@@ -153,16 +198,21 @@ def is_capture_or_check(board: chess.Board, move: chess.Move) -> bool:
     return in_check
 
 
-def classify_position(
-    board: chess.Board, engine: chess.engine.SimpleEngine, phase: str
+async def classify_position(
+    board: chess.Board, engine: chess.engine.UciProtocol, phase: str
 ) -> tuple[bool, bool]:
     """
     Classify position as tactical or quiet using Stockfish.
     Returns (is_tactical, is_mate) tuple.
     """
-    # Run multi-PV analysis
-    info = engine.analyse(
-        board, chess.engine.Limit(depth=STOCKFISH_DEPTH), multipv=MULTI_PV
+    # Run multi-PV analysis. A new game object each time sends ucinewgame,
+    # clearing the hash table, so the result doesn't depend on what this
+    # engine analyzed before
+    info = await engine.analyse(
+        board,
+        chess.engine.Limit(depth=STOCKFISH_DEPTH),
+        multipv=MULTI_PV,
+        game=object(),
     )
 
     if not info:
@@ -245,76 +295,211 @@ def classify_position(
     return is_tactical, is_mate
 
 
-def sample_position_from_game(
+@dataclass
+class Candidate:
+    """A position sampled from a game, before engine classification."""
+
+    game_id: str
+    avg_elo: float
+    board: chess.Board
+    ply: int
+    phase: str
+    fen4: str
+    pos_id: str
+    hash_bucket: int
+    likely_type: Optional[str]  # prescreen_type() from the game's [%eval]s
+
+    @property
+    def side_to_move(self) -> str:
+        return "white" if self.board.turn else "black"
+
+
+def sample_candidate(
     conn: sqlite3.Connection,
     game_id: str,
-    moves_uci: str,
+    moves_packed: bytes,
+    features: Optional[bytes],
     avg_elo: float,
-    engine: chess.engine.SimpleEngine,
-) -> Optional[Position]:
-    """Sample a single position from a game."""
-    moves = moves_uci.split() if moves_uci else []
+    evals: Optional[bytes] = None,
+) -> Optional[Candidate]:
+    """
+    Sample a single position from a game. Eligibility and phase come from the
+    per-ply features stored at ingestion (computed here for older databases).
+    The draw is seeded by the game, so it doesn't depend on processing order.
+    """
+    moves = move_codec.decode_moves(moves_packed) if moves_packed else []
     if not moves:
         return None
 
-    board = chess.Board()
+    if features is None:
+        features = ply_features.replay_features(moves)
 
     # Reservoir sampling - select one position from eligible moves
+    rng = random.Random(f"{SALT}:{game_id}")
     selected_ply = None
-    selected_board = None
+    selected_features = None
     eligible_count = 0
 
-    for ply, move_uci in enumerate(moves):
-        move = chess.Move.from_uci(move_uci)
-        board.push(move)
-
+    for ply, ply_feature in enumerate(ply_features.iter_features(features)):
         # Check position eligibility
-        if (
-            board.is_checkmate()
-            or board.is_stalemate()
-            or board.is_insufficient_material()
-            or board.halfmove_clock >= 80
-        ):
+        if not ply_feature[2] & ply_features.ELIGIBLE:
             continue
 
         # Reservoir sampling
         eligible_count += 1
-        if random.randint(1, eligible_count) == 1:
+        if rng.randint(1, eligible_count) == 1:
             selected_ply = ply + 1
-            selected_board = board.copy()
+            selected_features = ply_feature
 
-    if not selected_board:
+    if not selected_ply:
         return None
 
+    # Only the selected position needs a board
+    selected_board = chess.Board()
+    for move in moves[:selected_ply]:
+        selected_board.push(move)
+
     # Analyze selected position
-    phase = get_phase(selected_board, selected_ply)
+    material, _, flags = selected_features
+    phase = get_phase_from_features(
+        selected_ply, material, bool(flags & ply_features.HAS_QUEENS)
+    )
     fen4 = get_fen4(selected_board)
     pos_id, hash_bucket = calculate_pos_id(fen4)
 
     # Position deduplication is handled by the caller checking existing_pos_ids
     # No need to check database here since we track in memory
 
-    # Classify position
-    is_tactical, is_mate = classify_position(selected_board, engine, phase)
+    # Skip positions common across the corpus before spending engine time
+    if (
+        MAX_POSITION_GAMES is not None
+        and count_position_games(conn, selected_board) > MAX_POSITION_GAMES
+    ):
+        return None
 
-    return Position(
-        pos_id=pos_id,
-        fen=selected_board.fen(),
-        fen4=fen4,
+    likely_type = None
+    if evals:
+        likely_type = prescreen_type(ply_features.decode_evals(evals), selected_ply)
+
+    return Candidate(
         game_id=game_id,
+        avg_elo=avg_elo,
+        board=selected_board,
         ply=selected_ply,
         phase=phase,
-        side_to_move="white" if selected_board.turn else "black",
-        legal_move_count=len(list(selected_board.legal_moves)),
-        castling_rights=selected_board.castling_xfen(),
-        avg_elo=avg_elo,
-        elo_bucket=get_elo_bucket(avg_elo),
+        fen4=fen4,
+        pos_id=pos_id,
+        hash_bucket=hash_bucket,
+        likely_type=likely_type,
+    )
+
+
+def make_position(candidate: Candidate, is_tactical: bool, is_mate: bool) -> Position:
+    """Build the selected Position from a classified candidate."""
+    board = candidate.board
+    return Position(
+        pos_id=candidate.pos_id,
+        fen=board.fen(),
+        fen4=candidate.fen4,
+        game_id=candidate.game_id,
+        ply=candidate.ply,
+        phase=candidate.phase,
+        side_to_move=candidate.side_to_move,
+        legal_move_count=len(list(board.legal_moves)),
+        castling_rights=board.castling_xfen(),
+        avg_elo=candidate.avg_elo,
+        elo_bucket=get_elo_bucket(candidate.avg_elo),
         is_tactical=is_tactical,
         is_mate=is_mate,
-        hash_bucket=hash_bucket,
+        hash_bucket=candidate.hash_bucket,
     )
 
 
+class EnginePool:
+    """
+    Stockfish processes driven through python-chess's asyncio API. While the
+    engines search, a producer task samples the next candidates into a bounded
+    queue; one coroutine per engine classifies them. classify_in_order() hands
+    the results back in input order, so selection decisions are made exactly
+    as in a serial run.
+    """
+
+    def __init__(self, engines: List[chess.engine.UciProtocol]):
+        self.engines = engines
+
+    @classmethod
+    async def open(cls, size: int) -> "EnginePool":
+        engines: List[chess.engine.UciProtocol] = []
+        try:
+            for _ in range(size):
+                _, engine = await chess.engine.popen_uci(STOCKFISH_PATH)
+                engines.append(engine)
+        except Exception:
+            await cls(engines).close()
+            raise
+        return cls(engines)
+
+    async def classify_in_order(
+        self, candidates: Iterator[Candidate]
+    ) -> AsyncIterator[Tuple[Candidate, Tuple[bool, bool]]]:
+        """
+        Yield (candidate, classify_position() result) in the order of
+        `candidates`, keeping up to ENGINE_LOOKAHEAD positions per engine
+        sampled ahead. Closing the generator stops the producer and engines.
+        """
+        loop = asyncio.get_running_loop()
+        # Every sampled candidate with its pending result, in input order
+        ordered: asyncio.Queue = asyncio.Queue(len(self.engines) * ENGINE_LOOKAHEAD)
+        # The same candidates, waiting for an idle engine
+        work: asyncio.Queue = asyncio.Queue()
+
+        async def produce():
+            try:
+                for candidate in candidates:
+                    result = loop.create_future()
+                    await ordered.put((candidate, result))
+                    work.put_nowait((candidate, result))
+                    # Let finished searches be handled between samples
+                    await asyncio.sleep(0)
+            except Exception as e:
+                # Hand sampling errors to the consumer, in order
+                result = loop.create_future()
+                result.set_exception(e)
+                await ordered.put((None, result))
+            else:
+                await ordered.put((None, None))
+
+        async def classify(engine: chess.engine.UciProtocol):
+            while True:
+                candidate, result = await work.get()
+                try:
+                    result.set_result(
+                        await classify_position(
+                            candidate.board, engine, candidate.phase
+                        )
+                    )
+                except Exception as e:
+                    result.set_exception(e)
+
+        tasks = [asyncio.ensure_future(produce())]
+        tasks += [asyncio.ensure_future(classify(engine)) for engine in self.engines]
+        try:
+            while True:
+                candidate, result = await ordered.get()
+                if result is None:
+                    break
+                yield candidate, await result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def close(self):
+        for engine in self.engines:
+            await engine.quit()
+        self.engines = []
+
+
 def load_existing_positions(
     csv_path: str,
 ) -> Tuple[set, Dict[str, Dict[str, Dict[str, Dict[str, List[Position]]]]]]:
@@ -419,7 +604,7 @@ def write_positions_incremental(selected: Dict, csv_path: str, append: bool = Fa
         return count
 
 
-def main():
+async def main():
     if not os.path.exists("output/games.db"):
         print(
             "Error: output/games.db not found. Run 02_process_games.py first.",
@@ -427,9 +612,13 @@ def main():
         )
         sys.exit(1)
 
-    # Initialize engine
+    workers = ENGINE_WORKERS
+    if "--engines" in sys.argv:
+        workers = int(sys.argv[sys.argv.index("--engines") + 1])
+
+    # Initialize engines
     try:
-        engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
+        engines = await EnginePool.open(workers)
     except Exception as e:
         print(
             f"Error: Could not initialize Stockfish at '{STOCKFISH_PATH}': {e}",
@@ -441,6 +630,9 @@ def main():
         )
         sys.exit(1)
 
+    prescreen = EVAL_PRESCREEN or "--eval-prescreen" in sys.argv
+    prescreen_skips = 0
+
     # Load existing positions if any
     existing_pos_ids, selected = load_existing_positions(OUTPUT_CSV)
 
@@ -451,6 +643,36 @@ def main():
     conn = sqlite3.connect("output/games.db")
     cursor = conn.cursor()
 
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(games)")}
+    required = {"moves_packed", "ply_features", "ply_evals", "elo_bucket"}
+    if (
+        not required <= columns
+        or cursor.execute(
+            "SELECT 1 FROM games WHERE elo_bucket IS NULL LIMIT 1"
+        ).fetchone()
+    ):
+        print(
+            "Error: output/games.db is missing columns added since it was created. "
+            "Run 02_process_games.py --migrate first.",
+            file=sys.stderr,
+        )
+        conn.close()
+        await engines.close()
+        sys.exit(1)
+
+    # Without it every bucket scan sorts the games table (a bulk load of
+    # 02_process_games.py that was killed before building its indexes)
+    indexes = {row[1] for row in cursor.execute("PRAGMA index_list(games)")}
+    if "idx_games_bucket_rand_key" not in indexes:
+        print(
+            "Error: output/games.db has no games indexes, so its last load was "
+            "interrupted. Run 02_process_games.py again to finish it.",
+            file=sys.stderr,
+        )
+        conn.close()
+        await engines.close()
+        sys.exit(1)
+
     # Check overall progress
     total_positions = sum(
         len(positions)
@@ -466,7 +688,7 @@ def main():
             f"\nAlready have {total_positions} positions (target: {total_target}). Nothing to do."
         )
         conn.close()
-        engine.quit()
+        await engines.close()
         return
 
     print(f"\nStarting from {total_positions}/{total_target} positions...")
@@ -483,7 +705,7 @@ def main():
         print(f"  {bucket}: {bucket_count}/{GAME_DISTRIBUTION.get(bucket, 0)}")
 
     for elo_bucket, target_count in GAME_DISTRIBUTION.items():
-        min_elo, max_elo = ELO_RANGES[ELO_BUCKET_NAMES.index(elo_bucket)]
+        bucket_index = ELO_BUCKET_NAMES.index(elo_bucket)
 
         # Calculate targets for each phase and tactical/quiet split
         phase_targets = {}
@@ -517,38 +739,66 @@ def main():
             f"\nProcessing {elo_bucket} ELO bucket (current: {bucket_current}, target: {target_count})..."
         )
 
-        # Get all games in this ELO range, ordered by deterministic rand_key
+        # Stream the games in this ELO bucket, ordered by deterministic rand_key
         cursor.execute(
-            """
-            SELECT game_id, moves_uci, avg_elo 
-            FROM games 
-            WHERE avg_elo >= ? AND avg_elo < ? AND moves_uci IS NOT NULL
-            ORDER BY rand_key
-        """,
-            (min_elo, max_elo),
+            "SELECT COUNT(*) FROM games WHERE elo_bucket = ?", (bucket_index,)
         )
+        bucket_games = cursor.fetchone()[0]
+        games = iter_bucket_games(conn, bucket_index)
+
+        def stratum_full(
+            phase: str,
+            type_key: str,
+            color: str,
+            bucket: Dict = selected[elo_bucket],
+            targets: Dict = phase_targets,
+        ) -> bool:
+            return (
+                len(bucket[phase][type_key][color]) >= targets[phase][type_key][color]
+            )
 
-        games = cursor.fetchall()
-        game_idx = 0
+        def prescreened(candidate: Candidate, stratum_full=stratum_full) -> bool:
+            """Return whether the pre-screen drops a candidate, counting it."""
+            nonlocal prescreen_skips
+            dropped = bool(
+                prescreen
+                and candidate.likely_type
+                and stratum_full(
+                    candidate.phase, candidate.likely_type, candidate.side_to_move
+                )
+            )
+            prescreen_skips += dropped
+            return dropped
+
+        def candidates(
+            games=games, total=bucket_games, prescreened=prescreened
+        ) -> Iterator[Candidate]:
+            for game_idx, game in enumerate(games, 1):
+                game_id, moves_packed, features, evals, avg_elo = game
+
+                # Note: We can sample multiple positions from the same game
+                # Only duplicate FENs (pos_id) are avoided
+
+                # Sample position from game
+                if game_idx % 50 == 0:
+                    print(f"    Checking game {game_idx}/{total}...")
+                candidate = sample_candidate(
+                    conn, game_id, moves_packed, features, avg_elo, evals
+                )
+                # Strata only fill up, so one that is full already will still
+                # be full at this candidate's turn: don't queue engine work
+                if candidate and not prescreened(candidate):
+                    yield candidate
 
         # Track newly added positions for this bucket
         new_positions = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
 
-        while game_idx < len(games) and bucket_current < target_count:
-            game_id, moves_uci, avg_elo = games[game_idx]
-            game_idx += 1
-
-            # Note: We can sample multiple positions from the same game
-            # Only duplicate FENs (pos_id) are avoided
-
-            # Sample position from game
-            if game_idx % 50 == 0:
-                print(f"    Checking game {game_idx}/{len(games)}...")
-            position = sample_position_from_game(
-                conn, game_id, moves_uci, avg_elo, engine
-            )
-            if not position:
+        results = engines.classify_in_order(candidates())
+        async for candidate, (is_tactical, is_mate) in results:
+            # Pre-screen again: the stratum may have filled up since queueing
+            if prescreened(candidate):
                 continue
+            position = make_position(candidate, is_tactical, is_mate)
 
             # Check if this position already exists
             if position.pos_id in existing_pos_ids:
@@ -603,6 +853,10 @@ def main():
                     )
                     print(f"  Selected {bucket_current}/{target_count} positions...")
 
+                if bucket_current >= target_count:
+                    break
+        await results.aclose()
+
         # Write any remaining positions for this bucket
         if any(
             positions
@@ -616,7 +870,7 @@ def main():
                 f"  Final count for {elo_bucket}: {bucket_current}/{target_count} positions"
             )
 
-    engine.quit()
+    await engines.close()
 
     # Count final total
     final_total = sum(
@@ -631,6 +885,8 @@ def main():
     print(
         f"Mate positions: {mate_positions_count}/{MAX_MATE_POSITIONS} (cap: {MAX_MATE_POSITIONS})"
     )
+    if prescreen:
+        print(f"Positions dropped by eval pre-screen: {prescreen_skips}")
 
     # Also include puzzles (200 positions) - placeholder for now
     print("\nNote: Lichess puzzles (200 positions) need to be added separately")
@@ -639,4 +895,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -2,16 +2,19 @@
 """
 Fetches the Lichess puzzle database.
 Downloads and decompresses the full puzzle CSV file.
+The compressed download is cached (and resumable) under output/cache.
 """
 
 import os
 import subprocess
 import sys
 
+import downloader
+
 # Configuration
 URL = "https://database.lichess.org/lichess_db_puzzle.csv.zst"
 OUTPUT_FILE = "output/lichess_puzzles.csv"
-TEMP_FILE = "output/lichess_puzzles.csv.zst"
+CACHE_DIR = "output/cache"  # Compressed downloads, keyed by URL + ETag
 
 
 def download_puzzles():
@@ -27,7 +30,7 @@ def download_puzzles():
     os.makedirs(os.path.join(script_dir, "output"), exist_ok=True)
 
     output_path = os.path.join(script_dir, OUTPUT_FILE)
-    temp_path = os.path.join(script_dir, TEMP_FILE)
+    cache_dir = os.path.join(script_dir, CACHE_DIR)
 
     try:
         # First, check if zstd is available
@@ -45,23 +48,18 @@ def download_puzzles():
         print("Note: This file is approximately 250MB compressed, ~1GB uncompressed")
         print("Download may take several minutes depending on your connection...")
 
-        subprocess.run(
-            ["curl", "-L", "--progress-bar", "-o", temp_path, URL], check=True
-        )
+        compressed_path = downloader.download(URL, cache_dir)
 
         # Get compressed file size
-        compressed_size = os.path.getsize(temp_path)
+        compressed_size = os.path.getsize(compressed_path)
         print(f"\nDownloaded: {compressed_size / (1024 * 1024):.1f} MB (compressed)")
 
         # Decompress the file
         print("\nDecompressing...")
         subprocess.run(
-            ["zstd", "-d", temp_path, "-o", output_path, "--force"], check=True
+            ["zstd", "-d", compressed_path, "-o", output_path, "--force"], check=True
         )
 
-        # Remove the compressed file
-        os.remove(temp_path)
-
         # Check final file
         if os.path.exists(output_path):
             file_size = os.path.getsize(output_path)
@@ -86,16 +84,12 @@ def download_puzzles():
             sys.exit(1)
 
     except subprocess.CalledProcessError as e:
-        print(f"\nError during download/decompression: {e}")
-        # Clean up temp file if it exists
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        print(f"\nError during decompression: {e}")
         sys.exit(1)
     except KeyboardInterrupt:
         print("\n\nDownload interrupted by user")
-        # Clean up files
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        print("Partial download kept in cache; re-run to resume")
+        # Clean up partially decompressed output
         if os.path.exists(output_path):
             os.remove(output_path)
         sys.exit(1)
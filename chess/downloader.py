@@ -0,0 +1,229 @@
+"""
+Resumable, cached HTTP downloader for the Lichess dumps.
+
+Files are stored in a content-addressed cache keyed by URL + ETag, so repeated
+pipeline runs reuse an already downloaded dump; files served without an ETag
+or Last-Modified header are downloaded again every time. Large files are
+fetched as parallel HTTP Range segments; progress is persisted next to the
+partial file so an interrupted download resumes where it stopped instead of
+from byte zero.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import List, Optional
+from urllib.parse import urlparse
+
+import requests
+
+DEFAULT_CACHE_DIR = "output/cache"
+SEGMENTS = 4  # Parallel range requests per file
+MIN_SEGMENT_SIZE = 64 * 1024 * 1024  # Don't split files smaller than this
+CHUNK_SIZE = 1024 * 1024
+STATE_SAVE_INTERVAL = 16 * 1024 * 1024  # Persist progress every 16MB per segment
+TIMEOUT = 60
+
+
+def cache_key(url: str, etag: str) -> str:
+    """Return the cache key for a URL and its ETag."""
+    return hashlib.sha256(f"{url}\n{etag}".encode()).hexdigest()[:16]
+
+
+def cache_path(url: str, etag: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """Return the cache location of a URL at a given ETag."""
+    filename = os.path.basename(urlparse(url).path) or "download"
+    return os.path.join(cache_dir, f"{cache_key(url, etag)}-{filename}")
+
+
+class _SegmentedDownload:
+    """Parallel range download into a preallocated .part file."""
+
+    def __init__(self, url: str, part_path: str, etag: str, size: int, segments: int):
+        self.url = url
+        self.part_path = part_path
+        self.state_path = part_path + ".json"
+        self.etag = etag
+        self.size = size
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.segments = self._load_state() or self._new_state(segments)
+
+    def _new_state(self, segments: int) -> List[List[int]]:
+        """Split the file into [start, end, done] segments and preallocate it."""
+        count = max(1, min(segments, self.size // MIN_SEGMENT_SIZE))
+        step = -(-self.size // count)
+        with open(self.part_path, "wb") as f:
+            f.truncate(self.size)
+        return [
+            [start, min(start + step, self.size), 0]
+            for start in range(0, self.size, step)
+        ]
+
+    def _load_state(self) -> Optional[List[List[int]]]:
+        """Load saved progress if it belongs to the same remote file."""
+        if not (os.path.exists(self.state_path) and os.path.exists(self.part_path)):
+            return None
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("etag") != self.etag or state.get("size") != self.size:
+            return None
+        return state["segments"]
+
+    def _save_state(self):
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(
+                {"etag": self.etag, "size": self.size, "segments": self.segments}, f
+            )
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def downloaded(self) -> int:
+        return sum(done for _, _, done in self.segments)
+
+    def _fetch_segment(self, segment: List[int]):
+        start, end, done = segment
+        if start + done >= end:
+            return
+
+        headers = {"Range": f"bytes={start + done}-{end - 1}"}
+        if self.etag:
+            headers["If-Range"] = self.etag
+
+        with requests.get(
+            self.url, headers=headers, stream=True, timeout=TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise RuntimeError("Server ignored range request (file changed?)")
+
+            with open(self.part_path, "r+b") as f:
+                f.seek(start + done)
+                unsaved = 0
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    if self.stop.is_set():
+                        break
+                    chunk = chunk[: end - start - done]
+                    f.write(chunk)
+                    done += len(chunk)
+                    unsaved += len(chunk)
+                    if unsaved >= STATE_SAVE_INTERVAL:
+                        f.flush()
+                        with self.lock:
+                            segment[2] = done
+                            self._save_state()
+                        unsaved = 0
+                f.flush()
+                with self.lock:
+                    segment[2] = done
+                    self._save_state()
+
+        if not self.stop.is_set() and start + done < end:
+            raise RuntimeError("Connection closed before segment was complete")
+
+    def run(self):
+        """Download all unfinished segments, saving progress on any failure."""
+        with ThreadPoolExecutor(max_workers=len(self.segments)) as pool:
+            futures = [pool.submit(self._fetch_segment, s) for s in self.segments]
+            try:
+                pending = futures
+                while pending:
+                    done, pending = wait(
+                        pending, timeout=5, return_when=FIRST_EXCEPTION
+                    )
+                    for future in done:
+                        future.result()
+                    print(
+                        f"  {self.downloaded() / 1024 / 1024:,.1f}/"
+                        f"{self.size / 1024 / 1024:,.1f} MB"
+                    )
+            except BaseException:
+                self.stop.set()
+                raise
+            finally:
+                with self.lock:
+                    self._save_state()
+
+        os.remove(self.state_path)
+
+
+def _stream_download(url: str, part_path: str, etag: str, resumable: bool):
+    """Single-stream download, appending to an existing .part if possible."""
+    existing = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {}
+    if resumable and existing:
+        headers["Range"] = f"bytes={existing}-"
+        if etag:
+            headers["If-Range"] = etag
+
+    with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        if response.status_code == 416 and "Range" in headers:
+            # A previous run finished the .part but died before renaming it
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            if total == str(existing):
+                return
+            os.remove(part_path)
+            return _stream_download(url, part_path, etag, resumable)
+        response.raise_for_status()
+        mode = "ab" if response.status_code == 206 else "wb"
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+
+
+def download(
+    url: str, cache_dir: str = DEFAULT_CACHE_DIR, segments: int = SEGMENTS
+) -> str:
+    """
+    Download a URL into the cache and return the local path.
+    Reuses a cached copy if the remote ETag is unchanged and resumes partial
+    downloads left behind by an interrupted run. Without an ETag or
+    Last-Modified header nothing is reused.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    head = requests.head(url, allow_redirects=True, timeout=TIMEOUT)
+    head.raise_for_status()
+    etag = head.headers.get("ETag") or head.headers.get("Last-Modified", "")
+    size = int(head.headers.get("Content-Length", 0))
+    ranges = head.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+    path = cache_path(url, etag, cache_dir)
+    part_path = path + ".part"
+    if not etag:
+        # Without ETag or Last-Modified a cached copy or .part can't be
+        # validated against the remote file, so always fetch it again
+        for stale in (path, part_path, part_path + ".json"):
+            if os.path.exists(stale):
+                os.remove(stale)
+    elif os.path.exists(path):
+        print(f"Using cached download: {path}")
+        return path
+
+    if os.path.exists(part_path):
+        print(f"Resuming download: {part_path}")
+
+    # Follow redirects once so every segment hits the same server
+    resolved_url = head.url
+    started = time.time()
+    if ranges and size:
+        _SegmentedDownload(resolved_url, part_path, etag, size, segments).run()
+    else:
+        _stream_download(resolved_url, part_path, etag, ranges)
+
+    if size and os.path.getsize(part_path) != size:
+        raise RuntimeError(f"Downloaded size mismatch for {url}")
+
+    os.replace(part_path, path)
+    elapsed = max(time.time() - started, 1e-9)
+    file_size = os.path.getsize(path)
+    print(
+        f"Downloaded {file_size / 1024 / 1024:,.1f} MB "
+        f"({file_size / 1024 / 1024 / elapsed:.1f} MB/s) to {path}"
+    )
+    return path
@@ -0,0 +1,102 @@
+"""
+Throughput counters for the fetch stage.
+
+Each stage (compressed bytes in, decompressed bytes out, bytes skipped before
+the slice offset, bytes written) accumulates a byte count and the time spent
+in it. Records are emitted as JSON lines, periodically while fetching and once
+at the end, so it's visible whether the network, zstd or the disk is the
+bottleneck.
+"""
+
+import json
+import threading
+import time
+from typing import Dict, Optional
+
+STAGES = ("compressed_in", "decompressed_out", "skipped", "written")
+INTERVAL = 30.0  # Seconds between periodic records
+
+
+class FetchMetrics:
+    """Thread-safe per-stage byte counters and timings."""
+
+    def __init__(self, path: Optional[str] = None, interval: float = INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.bytes = dict.fromkeys(STAGES, 0)
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.started = time.time()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, stage: str, nbytes: int, seconds: float = 0.0):
+        """Account `nbytes` processed by a stage in `seconds` of work."""
+        with self.lock:
+            self.bytes[stage] += nbytes
+            self.seconds[stage] += seconds
+
+    def snapshot(self) -> Dict:
+        """
+        Return the current counters. `mb_per_s` is over wall-clock time since the
+        start; `busy_mb_per_s` is over the time spent inside the stage itself.
+        """
+        with self.lock:
+            elapsed = time.time() - self.started
+            stages = {}
+            for stage in STAGES:
+                nbytes = self.bytes[stage]
+                busy = self.seconds[stage]
+                stages[stage] = {
+                    "bytes": nbytes,
+                    "seconds": round(busy, 3),
+                    "mb_per_s": round(nbytes / 1024 / 1024 / elapsed, 2)
+                    if elapsed
+                    else 0.0,
+                    "busy_mb_per_s": round(nbytes / 1024 / 1024 / busy, 2)
+                    if busy
+                    else None,
+                }
+        return {"elapsed_s": round(elapsed, 3), "stages": stages}
+
+    def emit(self, kind: str):
+        """Print a JSON metrics record and append it to the metrics file."""
+        record = {"type": kind, "time": round(time.time(), 3), **self.snapshot()}
+        line = json.dumps(record)
+        print(f"[metrics] {line}", flush=True)
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.emit("progress")
+
+    def __enter__(self) -> "FetchMetrics":
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.emit("final")
+
+
+class CountingReader:
+    """File-like wrapper that reports bytes read (and time spent) to a stage."""
+
+    def __init__(self, raw, metrics: FetchMetrics, stage: str = "compressed_in"):
+        self.raw = raw
+        self.metrics = metrics
+        self.stage = stage
+        self.seconds = 0.0
+
+    def read(self, size: int = -1) -> bytes:
+        started = time.perf_counter()
+        data = self.raw.read(size)
+        elapsed = time.perf_counter() - started
+        self.seconds += elapsed
+        self.metrics.add(self.stage, len(data), elapsed)
+        return data
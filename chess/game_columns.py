@@ -0,0 +1,127 @@
+"""
+Columnar export of the games table.
+
+The metadata used for stratified sampling and statistics (game number, average
+ELO, time control, ply count, rand_key and result) is written as one NumPy
+`.npy` file per column, all in the same row order, plus a `columns.json` with
+the row count and the labels of the dictionary-encoded text columns. Readers
+memory-map the files with numpy.load(..., mmap_mode="r") and filter millions of
+games with vectorized operations instead of row-by-row SQL.
+
+The files are written with the array module, so exporting doesn't need NumPy;
+only reading them does.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+from array import array
+from typing import Dict, List
+
+COLUMNS_DIR = "output/columns"
+META_FILE = "columns.json"
+
+# name -> (array typecode, .npy dtype)
+NUMERIC_COLUMNS = {
+    "game_num": ("q", "<i8"),
+    "avg_elo": ("f", "<f4"),
+    "ply_count": ("h", "<i2"),
+    "rand_key": ("d", "<f8"),
+}
+# Text columns stored as int8 codes into the labels in columns.json
+CODED_COLUMNS = ("time_control", "result")
+CODE_TYPE = ("b", "|i1")
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+def write_npy(path: str, values: array, dtype: str):
+    """Write a 1-D array as a version 1.0 .npy file."""
+    header = (
+        f"{{'descr': '{dtype}', 'fortran_order': False, 'shape': ({len(values)},), }}"
+    )
+    # Data starts on a 64-byte boundary; the header ends with a newline
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + " " * padding + "\n").encode("latin1")
+
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values = array(values.typecode, values)
+        values.byteswap()
+    with open(path + ".tmp", "wb") as f:
+        f.write(NPY_MAGIC)
+        f.write(len(header).to_bytes(2, "little"))
+        f.write(header)
+        values.tofile(f)
+    os.replace(path + ".tmp", path)
+
+
+def export_columns(conn: sqlite3.Connection, out_dir: str = COLUMNS_DIR) -> int:
+    """Export the games table to `out_dir`. Returns the number of games."""
+    os.makedirs(out_dir, exist_ok=True)
+    columns = {name: array(typecode) for name, (typecode, _) in NUMERIC_COLUMNS.items()}
+    columns.update((name, array(CODE_TYPE[0])) for name in CODED_COLUMNS)
+    labels: Dict[str, Dict[str, int]] = {name: {} for name in CODED_COLUMNS}
+
+    cursor = conn.execute("""
+        SELECT game_id, avg_elo, ply_count, rand_key, time_control, result
+        FROM games
+        ORDER BY rowid
+    """)
+    for game_id, avg_elo, ply_count, rand_key, time_control, result in cursor:
+        columns["game_num"].append(int(game_id.rsplit("_", 1)[1]))
+        columns["avg_elo"].append(avg_elo)
+        columns["ply_count"].append(ply_count)
+        columns["rand_key"].append(rand_key)
+        for name, value in (("time_control", time_control), ("result", result)):
+            codes = labels[name]
+            columns[name].append(codes.setdefault(value, len(codes)))
+
+    for name, values in columns.items():
+        dtype = NUMERIC_COLUMNS[name][1] if name in NUMERIC_COLUMNS else CODE_TYPE[1]
+        write_npy(os.path.join(out_dir, f"{name}.npy"), values, dtype)
+
+    games = len(columns["game_num"])
+    meta = {"games": games, **{name: list(labels[name]) for name in CODED_COLUMNS}}
+    meta_path = os.path.join(out_dir, META_FILE)
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+    return games
+
+
+def is_current(conn: sqlite3.Connection, out_dir: str = COLUMNS_DIR) -> bool:
+    """Return whether an export exists and has as many games as the database."""
+    meta_path = os.path.join(out_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        games = json.load(f)["games"]
+    return games == conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+
+class GameColumns:
+    """
+    Memory-mapped columns of an export, by name. Coded text columns hold
+    indexes into `labels[name]`; code() gives the code of a label.
+    """
+
+    def __init__(self, out_dir: str = COLUMNS_DIR):
+        import numpy  # Only needed to read an export
+
+        with open(os.path.join(out_dir, META_FILE)) as f:
+            meta = json.load(f)
+        self.games: int = meta["games"]
+        self.labels: Dict[str, List[str]] = {name: meta[name] for name in CODED_COLUMNS}
+        self.arrays = {
+            name: numpy.load(os.path.join(out_dir, f"{name}.npy"), mmap_mode="r")
+            for name in (*NUMERIC_COLUMNS, *CODED_COLUMNS)
+        }
+
+    def __getitem__(self, name: str):
+        return self.arrays[name]
+
+    def code(self, name: str, label: str) -> int:
+        """Return the code of a label in a coded column, or -1 if it never occurs."""
+        labels = self.labels[name]
+        return labels.index(label) if label in labels else -1
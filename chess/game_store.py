@@ -0,0 +1,157 @@
+"""
+Random access to the PGN text of stored games.
+
+Every game in games.db records where it came from: (pgn_shard, pgn_frame,
+pgn_offset), see 02_process_games.py. GameStore memory-maps each input file
+once and serves a game's raw PGN bytes or its parsed chess.pgn.Game from that
+location, for debugging, re-analysis and spot-checking selected positions.
+
+For plain .pgn files, pgn_view() gives a zero-copy view of the mapping; the
+game's length comes from the file's .idx game index when there is one, otherwise from
+the next game boundary. For .pgn.zst files the zstd frame holding the game is
+decompressed from the mapping and kept until a game from another frame is
+requested, so lookups in the same frame don't decompress it again.
+"""
+
+import bisect
+import io
+import mmap
+import os
+import sqlite3
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import chess.pgn
+import zstandard
+
+import pgn_index
+import zstd_seek
+
+DB_PATH = "output/games.db"
+# Games stored before pgn_shard existed were all read from here
+LEGACY_PGN_FILE = "output/games.pgn"
+
+
+class GameStore:
+    """Maps input files on first use and keeps them mapped until close()."""
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.conn = sqlite3.connect(db_path)
+        self.shard_paths: Dict[Optional[int], str] = {None: LEGACY_PGN_FILE}
+        self.shard_paths.update(
+            self.conn.execute("SELECT shard_id, path FROM pgn_shards")
+        )
+        self.maps: Dict[str, mmap.mmap] = {}
+        # Per plain .pgn file: (game offsets, game lengths) from its .idx, or None
+        self.indexes: Dict[str, Optional[Tuple[array, array]]] = {}
+        self.frames: Dict[str, List[zstd_seek.Frame]] = {}
+        self.frame_cache: Tuple[Optional[str], int, bytes] = (None, -1, b"")
+
+    def _map(self, path: str) -> mmap.mmap:
+        mapping = self.maps.get(path)
+        if mapping is None:
+            with open(path, "rb") as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[path] = mapping
+        return mapping
+
+    def _game_length(self, path: str, offset: int) -> Optional[int]:
+        """Return a game's length from the file's .idx index, if it has one."""
+        if path not in self.indexes:
+            index = None
+            if os.path.exists(pgn_index.index_path(path)):
+                flat = pgn_index.read_index(pgn_index.index_path(path))
+                index = (flat[0::2], flat[1::2])
+            self.indexes[path] = index
+
+        index = self.indexes[path]
+        if index is None:
+            return None
+        offsets, lengths = index
+        i = bisect.bisect_left(offsets, offset)
+        if i < len(offsets) and offsets[i] == offset:
+            return lengths[i]
+        return None
+
+    def _plain_pgn(self, path: str, offset: int) -> memoryview:
+        mapping = self._map(path)
+        length = self._game_length(path, offset)
+        if length is not None:
+            end = offset + length
+        else:
+            end = mapping.find(pgn_index.BOUNDARY, offset)
+            end = len(mapping) if end == -1 else end + 1
+        return memoryview(mapping)[offset:end]
+
+    def _frame_data(self, path: str, frame: int) -> bytes:
+        """Return the decompressed data of a zstd frame, caching the last one."""
+        cached_path, cached_frame, data = self.frame_cache
+        if (cached_path, cached_frame) != (path, frame):
+            c_offset, c_size, _, d_size = self.frames[path][frame]
+            data = zstandard.ZstdDecompressor().decompress(
+                memoryview(self._map(path))[c_offset : c_offset + c_size],
+                max_output_size=d_size,
+            )
+            self.frame_cache = (path, frame, data)
+        return data
+
+    def _compressed_pgn(self, path: str, frame: int, offset: int) -> bytes:
+        if path not in self.frames:
+            self.frames[path] = zstd_seek.load_seek_table(path)
+
+        data = self._frame_data(path, frame)
+        end = data.find(pgn_index.BOUNDARY, offset)
+        if end != -1:
+            return data[offset : end + 1]
+
+        # The game runs into the next frame(s)
+        pgn = data[offset:]
+        for next_frame in range(frame + 1, len(self.frames[path])):
+            searched = max(len(pgn) - len(pgn_index.BOUNDARY) + 1, 0)
+            pgn += self._frame_data(path, next_frame)
+            end = pgn.find(pgn_index.BOUNDARY, searched)
+            if end != -1:
+                return pgn[: end + 1]
+        return pgn
+
+    def pgn_view(self, game_id: str) -> memoryview:
+        """
+        Return a memoryview of a game's raw PGN bytes, into the file mapping for
+        plain .pgn inputs. Views must be released (view.release(), or a `with`
+        block) before close(), which can't unmap a file while one exists.
+        Raises KeyError for an unknown game_id.
+        """
+        row = self.conn.execute(
+            "SELECT pgn_shard, pgn_frame, pgn_offset FROM games WHERE game_id = ?",
+            (game_id,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(game_id)
+
+        shard_id, frame, offset = row
+        path = self.shard_paths[shard_id]
+        if path.endswith(".zst"):
+            return memoryview(self._compressed_pgn(path, frame, offset))
+        return self._plain_pgn(path, offset)
+
+    def get_pgn(self, game_id: str) -> bytes:
+        """Return a copy of a game's raw PGN bytes (see pgn_view())."""
+        with self.pgn_view(game_id) as view:
+            return view.tobytes()
+
+    def get_game(self, game_id: str) -> Optional[chess.pgn.Game]:
+        """Return a game parsed with python-chess."""
+        text = self.get_pgn(game_id).decode("utf-8", errors="replace")
+        return chess.pgn.read_game(io.StringIO(text))
+
+    def close(self):
+        self.conn.close()
+        for mapping in self.maps.values():
+            mapping.close()
+        self.maps = {}
+
+    def __enter__(self) -> "GameStore":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,58 @@
+"""
+Packed binary encoding of game move lists.
+
+Each ply is a 16-bit little-endian code: from square (bits 0-5), to square
+(bits 6-11) and promotion piece type (bits 12-14, 0 for none). A game is stored
+as a BLOB of 2 bytes per ply instead of a ~5 bytes per ply UCI string, and is
+decoded straight into chess.Move objects without any string parsing.
+"""
+
+import sys
+from array import array
+from typing import Dict, Iterable, List
+
+import chess
+
+# Decoded moves are immutable, so each distinct code maps to one shared Move
+_MOVE_CACHE: Dict[int, chess.Move] = {}
+
+
+def move_code(move: chess.Move) -> int:
+    """Return the 16-bit code of a move."""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def code_move(code: int) -> chess.Move:
+    """Return the move for a 16-bit code."""
+    move = _MOVE_CACHE.get(code)
+    if move is None:
+        move = chess.Move(code & 63, (code >> 6) & 63, (code >> 12) or None)
+        _MOVE_CACHE[code] = move
+    return move
+
+
+def encode_moves(moves: Iterable[chess.Move]) -> bytes:
+    """Pack a sequence of moves into a BLOB."""
+    codes = array("H", map(move_code, moves))
+    if sys.byteorder == "big":
+        codes.byteswap()
+    return codes.tobytes()
+
+
+def decode_moves(data: bytes) -> List[chess.Move]:
+    """Unpack a BLOB written by encode_moves()."""
+    codes = array("H")
+    codes.frombytes(data)
+    if sys.byteorder == "big":
+        codes.byteswap()
+    return [code_move(code) for code in codes]
+
+
+def encode_uci(moves_uci: str) -> bytes:
+    """Pack a space-separated UCI move string (the old moves_uci format)."""
+    return encode_moves(chess.Move.from_uci(uci) for uci in moves_uci.split())
+
+
+def decode_uci(data: bytes) -> str:
+    """Unpack a BLOB into a space-separated UCI move string."""
+    return " ".join(move.uci() for move in decode_moves(data))
@@ -0,0 +1,121 @@
+"""
+PGN game boundaries and the game-offset sidecar index.
+
+A byte slice of a PGN dump almost never starts or ends on a game boundary.
+iter_aligned() trims a decompressed byte stream so it starts at the first
+`[Event ` header and ends at the first `[Event ` header at or after the
+requested size, recording the (offset, length) of every game on the way. The
+index is stored next to the PGN file so later steps can seek straight to any
+game (or split the file into game-aligned ranges) without re-scanning it.
+"""
+
+import os
+from array import array
+from typing import Iterator, Optional, Tuple
+
+EVENT_MARKER = b"[Event "
+BOUNDARY = b"\n" + EVENT_MARKER
+
+
+def index_path(pgn_path: str) -> str:
+    """Return the path of the game index stored next to a PGN file."""
+    return pgn_path + ".idx"
+
+
+def iter_aligned(
+    chunks: Iterator[bytes], size: int, index: Optional[array] = None
+) -> Iterator[bytes]:
+    """
+    Yield the bytes of a stream from its first game start up to the first game
+    start at or after stream position `size` (or the end of the stream), i.e.
+    every game starting before `size`. Nothing is yielded if no game does.
+
+    If `index` is given, (offset, length) pairs relative to the first yielded
+    byte are appended to it for every game.
+    """
+    buf = b""
+    buf_start = 0  # Stream position of buf[0]
+    origin = None  # Stream position of the first game
+    game_start = None
+    search_from = 0
+
+    try:
+        for chunk in chunks:
+            buf += chunk
+
+            if origin is None:
+                if buf.startswith(EVENT_MARKER) and buf_start == 0:
+                    found = 0
+                else:
+                    found = buf.find(BOUNDARY, search_from)
+                    found = found + 1 if found != -1 else -1
+                if found == -1:
+                    # Keep only what could be the start of a split marker
+                    keep = len(BOUNDARY) - 1
+                    buf_start += max(len(buf) - keep, 0)
+                    buf = buf[-keep:]
+                    search_from = 0
+                    if buf_start >= size:
+                        # Any game found from here on would start after `size`
+                        return
+                    continue
+                origin = game_start = buf_start + found
+                if origin >= size:
+                    return
+                buf = buf[found:]
+                buf_start = origin
+                search_from = 0
+
+            while True:
+                found = buf.find(BOUNDARY, search_from)
+                if found == -1:
+                    break
+                boundary = buf_start + found + 1
+                if index is not None:
+                    index.extend((game_start - origin, boundary - game_start))
+                game_start = boundary
+                search_from = found + 1
+                if boundary >= size:
+                    yield buf[: found + 1]
+                    return
+
+            # Emit everything that can't be part of an unseen boundary
+            safe = max(len(buf) - len(BOUNDARY) + 1, 0)
+            if safe:
+                yield buf[:safe]
+                buf = buf[safe:]
+                buf_start += safe
+                search_from = max(search_from - safe, 0)
+
+        # End of stream: the last game runs to the end
+        if origin is not None:
+            if buf:
+                yield buf
+            end = buf_start + len(buf)
+            if index is not None and end > game_start:
+                index.extend((game_start - origin, end - game_start))
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+
+
+def write_index(path: str, index: array):
+    """Write a game index (flat array of offset, length pairs) to disk."""
+    with open(path + ".tmp", "wb") as f:
+        index.tofile(f)
+    os.replace(path + ".tmp", path)
+
+
+def read_index(path: str) -> array:
+    """Read a game index written by write_index()."""
+    index = array("Q")
+    with open(path, "rb") as f:
+        index.frombytes(f.read())
+    return index
+
+
+def iter_index(index: array) -> Iterator[Tuple[int, int]]:
+    """Yield (offset, length) for every game in an index."""
+    for i in range(0, len(index), 2):
+        yield index[i], index[i + 1]
@@ -0,0 +1,187 @@
+"""
+Compact per-ply position features, computed once while ingesting games.
+
+For the position after every mainline ply, 3 bytes are stored: non-king
+material (pawn 1, knight/bishop 3, rook 5, queen 9), the halfmove clock (capped
+at 255) and flags (eligible for sampling, queens on the board, white to move).
+03_select_games.py picks an eligible ply and its phase from these without
+replaying the game move by move.
+
+ZobristTracker keeps the Polyglot Zobrist key of the position up to date move
+by move, for the position index of eligible plies.
+
+Lichess [%eval] annotations are kept as one signed 16-bit centipawn value per
+ply (White's point of view, NO_EVAL where missing), so step 3 can pre-screen
+candidate positions before running the engine.
+"""
+
+import sys
+from array import array
+from typing import Iterable, Iterator, Optional, Tuple
+
+import chess
+import chess.pgn
+import chess.polyglot
+
+FEATURE_SIZE = 3
+
+# Flag bits
+ELIGIBLE = 1
+HAS_QUEENS = 2
+WHITE_TO_MOVE = 4
+
+# Positions with this many halfmoves without progress are not sampled
+MAX_HALFMOVE_CLOCK = 80
+
+# (material, halfmove_clock, flags)
+Features = Tuple[int, int, int]
+
+# Per-ply evals: mates are stored as +-(MATE_SCORE - moves to mate)
+NO_EVAL = -32768
+MATE_SCORE = 30000
+
+_ZOBRIST = chess.polyglot.ZobristHasher(chess.polyglot.POLYGLOT_RANDOM_ARRAY)
+_RANDOM = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+
+
+def material_count(board: chess.Board) -> int:
+    """Count non-king material on the board."""
+    return (
+        chess.popcount(board.pawns)
+        + 3 * chess.popcount(board.knights | board.bishops)
+        + 5 * chess.popcount(board.rooks)
+        + 9 * chess.popcount(board.queens)
+    )
+
+
+def is_eligible(board: chess.Board) -> bool:
+    """
+    Return whether a position can be sampled: not checkmate or stalemate (no
+    legal moves), not insufficient material, halfmove clock below the limit.
+    """
+    return (
+        board.halfmove_clock < MAX_HALFMOVE_CLOCK
+        and not board.is_insufficient_material()
+        and any(board.generate_legal_moves())
+    )
+
+
+def board_features(board: chess.Board) -> bytes:
+    """Return the packed features of a position."""
+    flags = 0
+    if is_eligible(board):
+        flags |= ELIGIBLE
+    if board.queens:
+        flags |= HAS_QUEENS
+    if board.turn == chess.WHITE:
+        flags |= WHITE_TO_MOVE
+    return bytes((material_count(board), min(board.halfmove_clock, 255), flags))
+
+
+def replay_features(moves: Iterable[chess.Move]) -> bytes:
+    """Compute the packed features of a game by replaying it from the start."""
+    board = chess.Board()
+    features = bytearray()
+    for move in moves:
+        board.push(move)
+        features += board_features(board)
+    return bytes(features)
+
+
+def iter_features(data: bytes) -> Iterator[Features]:
+    """Yield (material, halfmove_clock, flags) for every ply, starting at ply 1."""
+    for i in range(0, len(data), FEATURE_SIZE):
+        yield data[i], data[i + 1], data[i + 2]
+
+
+def parse_eval(comment: str, white_to_move: bool) -> Optional[int]:
+    """
+    Return the [%eval] annotation of a move comment in centipawns from White's
+    point of view, or None if there is none.
+    """
+    match = chess.pgn.EVAL_REGEX.search(comment)
+    if not match:
+        return None
+    if match.group("mate"):
+        mate = int(match.group("mate"))
+        if mate == 0:
+            # Mate on the board: the side to move is mated
+            return -MATE_SCORE if white_to_move else MATE_SCORE
+        return MATE_SCORE - mate if mate > 0 else -MATE_SCORE - mate
+    cp = round(float(match.group("cp")) * 100)
+    return max(-MATE_SCORE + 1000, min(cp, MATE_SCORE - 1000))
+
+
+def encode_evals(evals: array) -> Optional[bytes]:
+    """Pack per-ply evals (array "h"); None if the game has no evals at all."""
+    if not any(value != NO_EVAL for value in evals):
+        return None
+    if sys.byteorder == "big":
+        evals = array("h", evals)
+        evals.byteswap()
+    return evals.tobytes()
+
+
+def decode_evals(data: bytes) -> array:
+    """Unpack per-ply evals written by encode_evals(); index 0 is ply 1."""
+    evals = array("h")
+    evals.frombytes(data)
+    if sys.byteorder == "big":
+        evals.byteswap()
+    return evals
+
+
+def _piece_key(piece_type: chess.PieceType, color: chess.Color, square: int) -> int:
+    return _RANDOM[64 * ((piece_type - 1) * 2 + color) + square]
+
+
+def signed_key(key: int) -> int:
+    """Convert an unsigned 64-bit key to the signed range of SQLite INTEGER."""
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class ZobristTracker:
+    """
+    Polyglot Zobrist key of a game's current position. The piece placement part
+    is updated incrementally on each move instead of rehashing all 64 squares;
+    key() equals chess.polyglot.zobrist_hash() of the board.
+    """
+
+    def __init__(self, board: chess.Board):
+        self.pieces = _ZOBRIST.hash_board(board)
+
+    def push(self, board: chess.Board, move: chess.Move):
+        """Account for a move, given the board before it is played."""
+        color = board.turn
+        piece_type = board.piece_type_at(move.from_square)
+        self.pieces ^= _piece_key(piece_type, color, move.from_square)
+
+        if board.is_castling(move):
+            # Standard chess: the rook jumps from its corner next to the king
+            rank = chess.square_rank(move.from_square)
+            kingside = board.is_kingside_castling(move)
+            rook_from = chess.square(7 if kingside else 0, rank)
+            rook_to = chess.square(5 if kingside else 3, rank)
+            king_to = chess.square(6 if kingside else 2, rank)
+            self.pieces ^= _piece_key(chess.KING, color, king_to)
+            self.pieces ^= _piece_key(chess.ROOK, color, rook_from)
+            self.pieces ^= _piece_key(chess.ROOK, color, rook_to)
+            return
+
+        captured = board.piece_type_at(move.to_square)
+        if captured:
+            self.pieces ^= _piece_key(captured, not color, move.to_square)
+        elif board.is_en_passant(move):
+            captured_square = move.to_square + (-8 if color == chess.WHITE else 8)
+            self.pieces ^= _piece_key(chess.PAWN, not color, captured_square)
+
+        self.pieces ^= _piece_key(move.promotion or piece_type, color, move.to_square)
+
+    def key(self, board: chess.Board) -> int:
+        """Return the key of the current position (the board after the moves)."""
+        return (
+            self.pieces
+            ^ _ZOBRIST.hash_castling(board)
+            ^ _ZOBRIST.hash_ep_square(board)
+            ^ _ZOBRIST.hash_turn(board)
+        )
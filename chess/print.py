@@ -7,6 +7,9 @@ import sqlite3
 from collections import defaultdict
 from pathlib import Path
 
+import game_columns
+from strata import ELO_BUCKET_NAMES, ELO_RANGES, PLY_BIN_SIZE
+
 
 def format_table(headers, rows, col_widths=None):
     """Format data as a pretty ASCII table."""
@@ -40,6 +43,67 @@ def format_table(headers, rows, col_widths=None):
     return "\n".join(lines)
 
 
+def get_corpus_stats(conn):
+    """
+    Read the distributions from the corpus_stats table maintained by
+    02_process_games.py. Returns None for databases without it.
+    """
+    try:
+        rows = conn.execute(
+            "SELECT elo_bucket, time_control, ply_bin, games FROM corpus_stats"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    if not rows:
+        return None
+
+    by_elo = defaultdict(int)
+    by_time_control = defaultdict(int)
+    by_ply_bin = defaultdict(int)
+    for elo_bucket, time_control, ply_bin, games in rows:
+        by_elo[elo_bucket] += games
+        by_time_control[time_control] += games
+        by_ply_bin[ply_bin] += games
+
+    elo_stats = [(name, by_elo[i]) for i, name in enumerate(ELO_BUCKET_NAMES)]
+    time_controls = sorted(by_time_control.items(), key=lambda item: -item[1])
+    ply_counts = [
+        (f"{ply_bin}-{ply_bin + PLY_BIN_SIZE - 1}", by_ply_bin[ply_bin])
+        for ply_bin in sorted(by_ply_bin)
+    ]
+    return sum(by_elo.values()), elo_stats, time_controls, ply_counts
+
+
+def get_column_stats(conn):
+    """
+    Compute the ELO and time control distributions from the columnar export
+    (see game_columns.py). Returns None if NumPy or a current export is missing.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    if not game_columns.is_current(conn):
+        return None
+
+    columns = game_columns.GameColumns()
+    avg_elo = columns["avg_elo"]
+    elo_stats = [
+        (name, int(numpy.count_nonzero((avg_elo >= min_elo) & (avg_elo < max_elo))))
+        for name, (min_elo, max_elo) in zip(ELO_BUCKET_NAMES, ELO_RANGES)
+    ]
+
+    counts = numpy.bincount(
+        columns["time_control"], minlength=len(columns.labels["time_control"])
+    )
+    time_controls = sorted(
+        zip(columns.labels["time_control"], counts.tolist()),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    return columns.games, elo_stats, time_controls
+
+
 def get_database_stats():
     """Get statistics from games.db."""
     db_path = "output/games.db"
@@ -50,16 +114,34 @@ def get_database_stats():
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
 
+        corpus_stats = get_corpus_stats(conn)
+        if corpus_stats:
+            total_games, elo_stats, time_controls, ply_counts = corpus_stats
+            conn.close()
+            return {
+                "total_games": total_games,
+                "elo_distribution": elo_stats,
+                "time_controls": time_controls[:5],  # Top 5
+                "ply_counts": ply_counts,
+            }
+
+        column_stats = get_column_stats(conn)
+        if column_stats:
+            total_games, elo_stats, time_controls = column_stats
+            conn.close()
+            return {
+                "total_games": total_games,
+                "elo_distribution": elo_stats,
+                "time_controls": time_controls[:5],  # Top 5
+            }
+
         # Total games
         cursor.execute("SELECT COUNT(*) FROM games")
         total_games = cursor.fetchone()[0]
 
         # Games by ELO bucket
         elo_stats = []
-        elo_ranges = [(0, 1400), (1400, 1800), (1800, 2200), (2200, 2600), (2600, 9999)]
-        elo_names = ["0-1400", "1400-1800", "1800-2200", "2200-2600", "2600+"]
-
-        for i, (min_elo, max_elo) in enumerate(elo_ranges):
+        for i, (min_elo, max_elo) in enumerate(ELO_RANGES):
             cursor.execute(
                 """
                 SELECT COUNT(*) FROM games 
@@ -68,7 +150,7 @@ def get_database_stats():
                 (min_elo, max_elo),
             )
             count = cursor.fetchone()[0]
-            elo_stats.append((elo_names[i], count))
+            elo_stats.append((ELO_BUCKET_NAMES[i], count))
 
         # Time control distribution
         cursor.execute("""
@@ -240,6 +322,12 @@ def main():
             rows = [[tc, f"{count:,}"] for tc, count in db_stats["time_controls"]]
             print(format_table(headers, rows))
 
+        if db_stats.get("ply_counts"):
+            print("\nGames by Ply Count:")
+            headers = ["Plies", "Count"]
+            rows = [[plies, f"{count:,}"] for plies, count in db_stats["ply_counts"]]
+            print(format_table(headers, rows))
+
         print("\nDatabase Features:")
         print("- Deterministic ordering: ✓ (rand_key column)")
         print("- Reproducible selection: ✓")
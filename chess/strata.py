@@ -0,0 +1,36 @@
+"""
+ELO buckets and ply-count bins shared by the pipeline steps.
+
+02_process_games.py stores each game's bucket index (games.elo_bucket) and
+counts games per bucket and ply-count bin in corpus_stats; 03_select_games.py
+samples its positions per bucket; print.py reports on both.
+"""
+
+# ELO buckets: [0, 1400), [1400, 1800), [1800, 2200), [2200, 2600), [2600, inf)
+ELO_RANGES = [(0, 1400), (1400, 1800), (1800, 2200), (2200, 2600), (2600, 9999)]
+ELO_BUCKET_NAMES = ["0-1400", "1400-1800", "1800-2200", "2200-2600", "2600+"]
+
+# Target distribution for 800 games positions
+GAME_DISTRIBUTION = {
+    "0-1400": 20,
+    "1400-1800": 50,
+    "1800-2200": 70,
+    "2200-2600": 40,
+    "2600+": 20,
+}
+
+# Width of the ply-count bins of corpus_stats
+PLY_BIN_SIZE = 20
+
+
+def get_elo_bucket_index(avg_elo: float) -> int:
+    """Return the index into ELO_RANGES of the bucket for a given average ELO."""
+    for i, (min_elo, max_elo) in enumerate(ELO_RANGES):
+        if min_elo <= avg_elo < max_elo:
+            return i
+    return len(ELO_RANGES) - 1
+
+
+def get_elo_bucket(avg_elo: float) -> str:
+    """Return the ELO bucket name for a given average ELO."""
+    return ELO_BUCKET_NAMES[get_elo_bucket_index(avg_elo)]
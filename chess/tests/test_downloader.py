@@ -0,0 +1,183 @@
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import downloader
+
+DATA = bytes(range(256)) * 40
+
+
+class Server:
+    """Range-capable server for DATA at /dump.pgn.zst, configured per test."""
+
+    def __init__(self):
+        self.data = DATA
+        self.etag = '"v1"'
+        self.send_size = True
+        self.cut = None  # Serve at most this many bytes per response
+        self.requests = []  # (method, Range, If-Range) of every request
+
+
+@pytest.fixture
+def server():
+    state = Server()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            self.respond(body=False)
+
+        def do_GET(self):
+            self.respond(body=True)
+
+        def respond(self, body: bool):
+            rng = self.headers.get("Range")
+            if_range = self.headers.get("If-Range")
+            state.requests.append((self.command, rng, if_range))
+            size = len(state.data)
+            start, end, status = 0, size, 200
+            if rng and (if_range is None or if_range == state.etag):
+                first, last = re.match(r"bytes=(\d+)-(\d*)", rng).groups()
+                start = int(first)
+                end = int(last) + 1 if last else size
+                status = 206
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+            if body and state.cut is not None:
+                end = min(end, start + state.cut)
+            self.send_response(status)
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+            if body or state.send_size:
+                self.send_header("Content-Length", str(end - start))
+            if state.etag:
+                self.send_header("ETag", state.etag)
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            if body:
+                self.wfile.write(state.data[start:end])
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    state.url = f"http://127.0.0.1:{httpd.server_port}/dump.pgn.zst"
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch):
+    monkeypatch.setattr(downloader, "MIN_SEGMENT_SIZE", 1024)
+    monkeypatch.setattr(downloader, "CHUNK_SIZE", 256)
+    monkeypatch.setattr(downloader, "STATE_SAVE_INTERVAL", 256)
+
+
+def gets(server):
+    return [r for r in server.requests if r[0] == "GET"]
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_segmented_download(server, tmp_path):
+    path = downloader.download(server.url, str(tmp_path), segments=4)
+
+    assert read(path) == DATA
+    ranges = sorted(rng for _, rng, _ in gets(server))
+    assert ranges == [
+        "bytes=0-2559",
+        "bytes=2560-5119",
+        "bytes=5120-7679",
+        "bytes=7680-10239",
+    ]
+    assert all(if_range == '"v1"' for _, _, if_range in gets(server))
+    assert not os.path.exists(path + ".part")
+    assert not os.path.exists(path + ".part.json")
+
+
+def test_segmented_resume_after_interruption(server, tmp_path):
+    server.cut = 1000
+    with pytest.raises(RuntimeError):
+        downloader.download(server.url, str(tmp_path), segments=4)
+    server.cut = None
+    server.requests.clear()
+
+    path = downloader.download(server.url, str(tmp_path), segments=4)
+
+    assert read(path) == DATA
+    # Segments pick up after the bytes they saved, not at their start
+    resumed = sorted(
+        tuple(map(int, re.match(r"bytes=(\d+)-(\d+)", rng).groups()))
+        for _, rng, _ in gets(server)
+    )
+    assert [end for _, end in resumed] == [2559, 5119, 7679, 10239]
+    starts = [start for start, _ in resumed]
+    segment_starts = [0, 2560, 5120, 7680]
+    assert starts != segment_starts
+    for start, segment_start in zip(starts, segment_starts):
+        assert segment_start <= start <= segment_start + 1000
+
+
+def test_stream_resume_sends_if_range(server, tmp_path):
+    server.send_size = False
+    part_path = downloader.cache_path(server.url, '"v1"', str(tmp_path)) + ".part"
+    with open(part_path, "wb") as f:
+        f.write(DATA[:3000])
+
+    path = downloader.download(server.url, str(tmp_path))
+
+    assert read(path) == DATA
+    assert gets(server) == [("GET", "bytes=3000-", '"v1"')]
+
+
+def test_stream_resume_of_finished_part(server, tmp_path):
+    server.send_size = False
+    part_path = downloader.cache_path(server.url, '"v1"', str(tmp_path)) + ".part"
+    with open(part_path, "wb") as f:
+        f.write(DATA)
+
+    path = downloader.download(server.url, str(tmp_path))
+
+    assert read(path) == DATA
+    assert gets(server) == [("GET", f"bytes={len(DATA)}-", '"v1"')]
+
+
+def test_cache_hit_and_miss_on_etag_change(server, tmp_path):
+    first = downloader.download(server.url, str(tmp_path))
+    fetched = len(gets(server))
+
+    assert downloader.download(server.url, str(tmp_path)) == first
+    assert len(gets(server)) == fetched
+
+    server.etag = '"v2"'
+    server.data = DATA[::-1]
+    second = downloader.download(server.url, str(tmp_path))
+
+    assert second != first
+    assert len(gets(server)) > fetched
+    assert read(second) == DATA[::-1]
+    assert read(first) == DATA
+
+
+def test_no_validator_is_never_cached(server, tmp_path):
+    server.etag = ""
+    downloader.download(server.url, str(tmp_path))
+    fetched = len(gets(server))
+
+    server.data = DATA[::-1]
+    path = downloader.download(server.url, str(tmp_path))
+
+    assert len(gets(server)) > fetched
+    assert read(path) == DATA[::-1]
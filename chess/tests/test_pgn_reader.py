@@ -0,0 +1,54 @@
+import importlib
+import io
+
+# Module name starts with a digit, so it can't be a plain import
+process_games = importlib.import_module("02_process_games")
+
+
+def game(event: str, movetext: str) -> bytes:
+    return f'[Event "{event}"]\n[White "a"]\n[Black "b"]\n\n{movetext}\n\n'.encode()
+
+
+def read_all(data: bytes):
+    """Return (event, game or None) for every record, parsing odd games."""
+    pgn = process_games.PgnRecordReader(io.BytesIO(data))
+    records = []
+    while True:
+        record = pgn.read_headers()
+        if record is None:
+            return records
+        _, headers = record
+        if len(records) % 2:
+            pgn.skip_movetext()
+            records.append((headers["Event"], None))
+        else:
+            records.append((headers["Event"], pgn.read_game()))
+
+
+def test_brace_inside_comment_does_not_merge_games():
+    data = (
+        game("one", "1. e4 { see { this } e5 2. Nf3 *")
+        + game("two", "1. d4 { another { brace } d5 *")
+        + game("three", "1. c4 c5 *")
+        + game("four", "1. Nf3 *")
+    )
+    records = read_all(data)
+    assert [event for event, _ in records] == ["one", "two", "three", "four"]
+    assert [move.uci() for move in records[0][1].moves] == ["e2e4", "e7e5", "g1f3"]
+    assert [move.uci() for move in records[2][1].moves] == ["c2c4", "c7c5"]
+
+
+def test_blank_line_inside_comment_stays_in_game():
+    data = game("one", "1. e4 { a comment\n\nspanning a blank line } e5 *") + game(
+        "two", "1. d4 *"
+    )
+    records = read_all(data)
+    assert [event for event, _ in records] == ["one", "two"]
+    assert [move.uci() for move in records[0][1].moves] == ["e2e4", "e7e5"]
+
+
+def test_brace_in_rest_of_line_comment_is_ignored():
+    data = game("one", "1. e4 ; not a { comment\ne5 *") + game("two", "1. d4 *")
+    records = read_all(data)
+    assert [event for event, _ in records] == ["one", "two"]
+    assert [move.uci() for move in records[0][1].moves] == ["e2e4", "e7e5"]
@@ -0,0 +1,194 @@
+"""
+Seek table for zstd-compressed Lichess dumps.
+
+A zstd stream is a sequence of independently decompressible frames. Scanning the
+frame headers once gives a table mapping each frame's compressed offset to its
+decompressed offset, so a slice of the decompressed data can be extracted by
+decompressing only the frames that cover it.
+
+Note: dumps written as a single frame get a one-entry table, in which case
+extraction still has to decompress from the start of the file (but only once
+per run, and without a pipe through external tools).
+"""
+
+import json
+import os
+import struct
+import time
+from typing import Iterator, List, Optional, Tuple
+
+import zstandard
+
+ZSTD_MAGIC = 0xFD2FB528
+SKIPPABLE_MAGIC_MIN = 0x184D2A50
+SKIPPABLE_MAGIC_MAX = 0x184D2A5F
+READ_SIZE = 1024 * 1024
+
+# (compressed_offset, compressed_size, decompressed_offset, decompressed_size)
+Frame = Tuple[int, int, int, int]
+
+
+def seek_table_path(dump_path: str) -> str:
+    """Return the path of the seek table stored next to a dump."""
+    return dump_path + ".seek.json"
+
+
+def _read_exact(f, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError(f"Truncated zstd frame at offset {f.tell()}")
+    return data
+
+
+def _parse_frame(f, dump_size: int) -> Tuple[int, Optional[int]]:
+    """
+    Parse one frame starting right after its magic number.
+    Returns (compressed_size_after_magic, content_size or None).
+    """
+    start = f.tell()
+    descriptor = _read_exact(f, 1)[0]
+    fcs_flag = descriptor >> 6
+    single_segment = (descriptor >> 5) & 1
+    has_checksum = (descriptor >> 2) & 1
+    dict_id_size = (0, 1, 2, 4)[descriptor & 3]
+    fcs_size = (1 if single_segment else 0, 2, 4, 8)[fcs_flag]
+
+    header = _read_exact(f, (0 if single_segment else 1) + dict_id_size + fcs_size)
+    content_size = None
+    if fcs_size:
+        raw = header[len(header) - fcs_size :]
+        content_size = int.from_bytes(raw, "little")
+        if fcs_size == 2:
+            content_size += 256
+
+    # Walk block headers without decompressing
+    while True:
+        block_header = int.from_bytes(_read_exact(f, 3), "little")
+        last_block = block_header & 1
+        block_type = (block_header >> 1) & 3
+        block_size = block_header >> 3
+        if block_type == 3:
+            raise ValueError(f"Reserved zstd block type at offset {f.tell() - 3}")
+        payload = 1 if block_type == 1 else block_size
+        if f.tell() + payload > dump_size:
+            raise ValueError("Truncated zstd block")
+        f.seek(payload, os.SEEK_CUR)
+        if last_block:
+            break
+
+    if has_checksum:
+        f.seek(4, os.SEEK_CUR)
+
+    return f.tell() - start, content_size
+
+
+def _frame_content_size(f, offset: int, size: int) -> int:
+    """Decompress a frame without a content size field just to measure it."""
+    f.seek(offset)
+    dobj = zstandard.ZstdDecompressor().decompressobj()
+    total = 0
+    remaining = size
+    while remaining:
+        chunk = f.read(min(READ_SIZE, remaining))
+        remaining -= len(chunk)
+        total += len(dobj.decompress(chunk))
+    return total
+
+
+def build_seek_table(dump_path: str) -> List[Frame]:
+    """Scan all frame headers of a zstd file and build its seek table."""
+    dump_size = os.path.getsize(dump_path)
+    frames = []
+    decompressed_offset = 0
+
+    with open(dump_path, "rb") as f:
+        while f.tell() < dump_size:
+            frame_offset = f.tell()
+            (magic,) = struct.unpack("<I", _read_exact(f, 4))
+
+            if SKIPPABLE_MAGIC_MIN <= magic <= SKIPPABLE_MAGIC_MAX:
+                (skip_size,) = struct.unpack("<I", _read_exact(f, 4))
+                f.seek(skip_size, os.SEEK_CUR)
+                continue
+            if magic != ZSTD_MAGIC:
+                raise ValueError(f"Bad zstd magic at offset {frame_offset}")
+
+            body_size, content_size = _parse_frame(f, dump_size)
+            compressed_size = 4 + body_size
+            next_offset = f.tell()
+            if content_size is None:
+                content_size = _frame_content_size(f, frame_offset, compressed_size)
+                f.seek(next_offset)
+
+            frames.append(
+                (frame_offset, compressed_size, decompressed_offset, content_size)
+            )
+            decompressed_offset += content_size
+
+    return frames
+
+
+def load_seek_table(dump_path: str) -> List[Frame]:
+    """Load the persisted seek table for a dump, building it if missing or stale."""
+    table_path = seek_table_path(dump_path)
+    stat = os.stat(dump_path)
+
+    if os.path.exists(table_path):
+        with open(table_path) as f:
+            data = json.load(f)
+        if data.get("size") == stat.st_size and data.get("mtime") == stat.st_mtime:
+            return [tuple(frame) for frame in data["frames"]]
+
+    print(f"Building zstd seek table for {dump_path}...")
+    frames = build_seek_table(dump_path)
+    with open(table_path + ".tmp", "w") as f:
+        json.dump({"size": stat.st_size, "mtime": stat.st_mtime, "frames": frames}, f)
+    os.replace(table_path + ".tmp", table_path)
+    print(f"Indexed {len(frames):,} frames")
+    return frames
+
+
+def iter_range(
+    dump_path: str, frames: List[Frame], offset: int, size: int, metrics=None
+) -> Iterator[bytes]:
+    """
+    Yield the decompressed bytes in [offset, offset + size), decompressing only
+    the frames that overlap the range.
+
+    If given, `metrics` (see fetch_metrics.FetchMetrics) is told about bytes
+    read, decompressed and skipped.
+    """
+    end = offset + size
+    dctx = zstandard.ZstdDecompressor()
+
+    with open(dump_path, "rb") as f:
+        for c_offset, c_size, d_offset, d_size in frames:
+            if d_offset + d_size <= offset:
+                continue
+            if d_offset >= end:
+                break
+
+            f.seek(c_offset)
+            position = d_offset
+            dobj = dctx.decompressobj()
+            remaining = c_size
+            while remaining and position < end:
+                started = time.perf_counter()
+                chunk = f.read(min(READ_SIZE, remaining))
+                read_done = time.perf_counter()
+                remaining -= len(chunk)
+                data = dobj.decompress(chunk)
+                if metrics:
+                    metrics.add("compressed_in", len(chunk), read_done - started)
+                    metrics.add(
+                        "decompressed_out", len(data), time.perf_counter() - read_done
+                    )
+                chunk_start = position
+                position += len(data)
+                lo = min(max(offset - chunk_start, 0), len(data))
+                if metrics and lo:
+                    metrics.add("skipped", lo)
+                if position <= offset:
+                    continue
+                hi = min(end - chunk_start, len(data))
+                yield data[lo:hi]